@@ -0,0 +1,302 @@
+# Shared agent core for the voice loop and the chat window
+# Everything here is built once per process, main.py and chat.py both import it so they share one LLM, one set of
+# tools and one conversation memory. Calls go through run_agent so the two frontends never run the agent at once
+
+import os
+import threading
+import configparser
+from pathlib import Path
+from dotenv import load_dotenv
+
+import openai
+from langchain.agents import Tool
+from langchain.chat_models import ChatOpenAI
+from langchain.agents import initialize_agent
+from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain.callbacks.base import CallbackManager
+
+from callbacks import FinalAnswerStreamHandler, TelemetryCallbackHandler, ToolUseTracker
+from telemetry import Telemetry, TelemetrySettings
+from answer_cache import AnswerCache, AnswerCacheSettings
+from calculator import LocalCalculator
+from intent_router import IntentRouter, IntentRouterSettings, AGENT
+from tool_cache import ToolCache, ToolCacheSettings
+from embedding_cache import CachedEmbeddings, EmbeddingCacheSettings
+from token_memory import IncrementalTokenMemory
+from compaction import ConversationCompactor, CompactionSettings
+from conversation_store import ConversationStore, ConversationStoreSettings
+
+# Each tool's wrapper, and whatever library it needs, is only imported and built when the tool is enabled in [tools]
+
+# Load settings.ini and get bot name
+config = configparser.ConfigParser()
+config.read("settings.ini")
+bot_name = config.get("settings", "bot_name")
+BOT_NAME = bot_name
+
+class SearchSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.enable_search = config.getboolean("tools", "enable_search")
+        self.enable_wikipedia = config.getboolean("tools", "enable_wikipedia")
+        self.enable_calculator = config.getboolean("tools", "enable_calculator")
+        self.enable_wolfram_alpha = config.getboolean("tools", "enable_wolfram_alpha")
+        self.enable_weather = config.getboolean("tools", "enable_weather")
+        self.enable_zapier = config.getboolean("tools", "enable_zapier")
+        self.enable_pinecone = config.getboolean("tools", "enable_pinecone")
+
+# Initialize variables
+env_path = Path(__file__).parent / ".env"
+load_dotenv(dotenv_path=env_path)
+openai.api_key = os.getenv("OPENAI_API_KEY")
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GOOGLE_CSE_ID = os.getenv("GOOGLE_CSE_ID")
+WOLFROM_ALPHA_APPID = os.getenv("WOLFROM_ALPHA_APPID")
+OPENWEATHERMAP_API_KEY = os.getenv("OPENWEATHERMAP_API_KEY")
+ZAPIER_NLA_API_KEY = os.getenv("ZAPIER_NLA_API_KEY")
+PINE_API_KEY = os.getenv("PINE_API_KEY")
+PINE_ENV = os.getenv("PINE_ENV")
+
+# Embeddings go through a persistent cache so repeated questions don't pay for another API call
+embeddings = CachedEmbeddings.from_settings(OpenAIEmbeddings(), EmbeddingCacheSettings())
+
+settings = SearchSettings("settings.ini")
+
+def load_docsearch():
+    # Either Pinecone or the local memory-mapped index (vector_store in settings.ini)
+    if config.get("pinecone", "vector_store") == "local":
+        from local_vectorstore import LocalVectorStore
+        return LocalVectorStore(config.get("pinecone", "local_index_path"), embeddings)
+
+    import pinecone
+    from langchain.vectorstores import Pinecone
+    pinecone_env = config.get("pinecone", "pinecone_env")
+
+    pinecone.init(
+        api_key=PINE_API_KEY,
+        environment=pinecone_env
+    )
+
+    index_name = config.get("pinecone", "pinecone_index")
+    return Pinecone.from_existing_index(index_name, embeddings)
+
+# Stage timings for both frontends go through this one instance, see [telemetry] in settings.ini
+telemetry = Telemetry.from_settings(TelemetrySettings())
+
+# Define the memory and the LLM engine
+# The LLM streams its tokens so frontends can show or speak the final answer while it is being written
+stream_handler = FinalAnswerStreamHandler()
+llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0.5, max_tokens=150, verbose=True, streaming=True, callback_manager=CallbackManager([stream_handler, TelemetryCallbackHandler(telemetry, "llm.agent")]))
+memory_token_limit = config.getint("settings", "memory_token_limit")
+# Messages are tokenized once when added, pruning to the limit never re-tokenizes the history
+memory = IncrementalTokenMemory(llm=llm, max_token_limit=memory_token_limit, memory_key="chat_history", return_messages=True)
+# Turns are persisted to SQLite in the background and the tail of the session is loaded on first use
+conversation_store_settings = ConversationStoreSettings()
+conversation_store = ConversationStore.from_settings(conversation_store_settings)
+if conversation_store is not None:
+    memory.attach_store(conversation_store, conversation_store.session(conversation_store_settings), conversation_store_settings.tail_messages)
+# Older turns are summarized by a separate, non-streaming LLM so it never feeds the stream handler
+summary_llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, max_tokens=256, callback_manager=CallbackManager([TelemetryCallbackHandler(telemetry, "llm.summary")]))
+
+# Repeated lookups are served from the tool cache, real-time tools get short TTLs and reference tools long ones
+tool_cache_settings = ToolCacheSettings()
+tool_cache = ToolCache.from_settings(tool_cache_settings, telemetry)
+
+def cached_tool(name, func, ttl):
+    if tool_cache is None:
+        return func
+    return tool_cache.wrap(name, func, ttl)
+
+tools = []
+calculator = None
+
+if settings.enable_search:
+    from langchain.utilities import GoogleSearchAPIWrapper
+    search = GoogleSearchAPIWrapper(k=2)
+    tools.append(
+        Tool(
+            name="Search",
+            func=cached_tool("Search", search.run, tool_cache_settings.ttl_search),
+            description="Useful when you need to answer questions about current events and real-time information"
+        )
+    )
+if settings.enable_wikipedia:
+    from langchain.chains.summarize import load_summarize_chain
+    from wiki_tool import WikipediaTool, WikipediaSettings
+    wikisummarize = load_summarize_chain(llm, chain_type="stuff")
+    # Pages are fetched in parallel and trimmed locally to the query, the summarizer only runs if use_llm_summary is set
+    wikipedia = WikipediaTool.from_settings(wikisummarize, WikipediaSettings())
+    tools.append(
+        Tool(
+            name="Wikipedia",
+            func=cached_tool("Wikipedia", wikipedia.run, tool_cache_settings.ttl_wikipedia),
+            description="Useful for searching information on historical information on Wikipedia. "
+            "Use this more than the normal search if the question is about events that occured before 2023, like the 'What was the 2008 financial crisis?' or 'Who won the 2016 US presidential election?'"
+        )
+    )
+if settings.enable_calculator:
+    from langchain.chains import LLMMathChain
+    llm_math = LLMMathChain(llm=llm)
+    # Math is evaluated locally, LLMMathChain only sees what the local parser can't handle
+    calculator = LocalCalculator(fallback=llm_math.run)
+    tools.append(
+        Tool(
+            name='Calculator',
+            func=calculator.run,
+            description='Useful for when you need to answer questions about math or convert units. Input should be a math expression like "12 * (3 + 4)" or a conversion like "5 miles to km".'
+        )
+    )
+if settings.enable_wolfram_alpha:
+    from langchain.utilities import WolframAlphaAPIWrapper
+    wolfram_alpha = WolframAlphaAPIWrapper()
+    tools.append(
+        Tool(
+            name='Wolfram Alpha',
+            func=cached_tool("Wolfram Alpha", wolfram_alpha.run, tool_cache_settings.ttl_wolfram_alpha),
+            description="Useful for when you need to answer questions about Math, "
+                        "Science, Technology, Culture, people, Society and Everyday Life. "
+                        "Input should be a search query"
+        )
+    )
+if settings.enable_weather:
+    from langchain.utilities import OpenWeatherMapAPIWrapper
+    weather = OpenWeatherMapAPIWrapper()
+    tools.append(
+        Tool(
+            name='Weather',
+            func=cached_tool("Weather", weather.run, tool_cache_settings.ttl_weather),
+            description="Useful for when you need to answer questions about weather."
+        )
+    )
+# Adjust pinecone tool settings in settings.ini
+if settings.enable_pinecone:
+    from retrieval_qa import RetrievalQAEngine, RetrievalQASettings
+    # Answers from the vector store with one LLM call by default, mode and k are under [pinecone] in settings.ini
+    pinecone_tool = RetrievalQAEngine.from_settings(llm, load_docsearch(), RetrievalQASettings())
+    pinecone_name = config.get("pinecone", "tool_name")
+    pinecone_description = config.get("pinecone", "tool_description")
+
+    tools.append(
+        Tool(
+            name=pinecone_name,
+            func=pinecone_tool.run,
+            description=pinecone_description
+        )
+    )
+
+bot_context = config.get("settings", "bot_context")
+CONTEXT = bot_context
+
+# Zapier comes as a toolkit, its actions are added next to the other tools
+zapier_tools = []
+if settings.enable_zapier:
+    from langchain.utilities.zapier import ZapierNLAWrapper
+    from langchain.agents.agent_toolkits import ZapierToolkit
+    zapier = ZapierNLAWrapper()
+    toolkit = ZapierToolkit.from_zapier_nla_wrapper(zapier)
+    # Zapier's actions are tool classes rather than Tools, each is wrapped in a Tool so it gets a span like the rest
+    zapier_tools = [
+        Tool(name=action.name, func=action._run, description=action.description, return_direct=action.return_direct)
+        for action in toolkit.get_tools()
+    ]
+
+# Every tool call gets a span, cache hits included
+for tool in [*zapier_tools, *tools]:
+    tool.func = telemetry.timed(f"tool.{tool.name}", tool.func)
+
+agent_chain = initialize_agent([*zapier_tools, *tools], llm, agent="chat-conversational-react-description", verbose=True, memory=memory)
+
+# The bot context is pinned as a system message so pruning and clearing never drop it
+memory.pin(CONTEXT)
+
+agent_lock = threading.Lock()
+turn_listeners = []
+
+# Opt-in: answers to questions close enough to an earlier one are served without running the agent,
+# unless that earlier answer came from a time-sensitive tool
+answer_cache_settings = AnswerCacheSettings()
+answer_cache = AnswerCache.from_settings(embeddings, answer_cache_settings)
+time_sensitive_tools = set(answer_cache_settings.exclude_tools)
+if "Zapier" in time_sensitive_tools:
+    time_sensitive_tools.update(tool.name for tool in zapier_tools)
+tool_tracker = ToolUseTracker()
+agent_chain.callback_manager.add_handler(tool_tracker)
+
+# Greetings, thanks, closings and plain math are answered locally, everything else goes to the agent
+intent_router = IntentRouter.from_settings(embeddings, BOT_NAME, IntentRouterSettings(), calculator, telemetry)
+
+# Folds older turns into a rolling summary between turns instead of waiting for the context to overflow
+compactor = ConversationCompactor.from_settings(memory, summary_llm, agent_chain.agent.llm_chain.prompt, agent_lock, CompactionSettings(), llm.max_tokens)
+
+def route_turn(input_text):
+    if intent_router is None:
+        return AGENT
+    with telemetry.span("router.route") as span:
+        route = intent_router.route(input_text)
+        span["intent"] = route.intent
+    telemetry.count(f"router.{route.intent}")
+    return route
+
+def run_agent(input_text, on_token=None, source=None, cancel_event=None, route=None):
+    # on_token receives the final answer as it streams in, turn listeners hear about every finished turn
+    # so a frontend can show turns that came in through the other one
+    # If cancel_event gets set the run stops at the next LLM call or token and raises RunCancelled
+    # Pass the route from route_turn when the caller needs it too, otherwise the turn is routed here
+    if route is None:
+        route = route_turn(input_text)
+    if route.handled:
+        # Saved like a normal turn so the agent still sees it in the history
+        with agent_lock:
+            memory.save_context({"input": input_text}, {"output": route.response})
+        if on_token is not None:
+            on_token(route.response)
+        if compactor is not None:
+            compactor.after_turn()
+        for listener in list(turn_listeners):
+            listener(source, input_text, route.response)
+        return route.response
+    with agent_lock:
+        stream_handler.listener = on_token
+        stream_handler.cancel_event = cancel_event
+        if compactor is not None:
+            compactor.before_turn(input_text)
+        query_vector = None
+        cached = None
+        if answer_cache is not None:
+            with telemetry.span("answer_cache.lookup") as span:
+                query_vector = answer_cache.embed(input_text)
+                cached = answer_cache.lookup(query_vector)
+                span["hit"] = cached is not None
+            telemetry.count("answer_cache.hits" if cached is not None else "answer_cache.misses")
+        try:
+            if cached is not None:
+                # Served like a normal turn so the memory, the stream listener and the other frontend all see it
+                print(f"Answer cache hit for '{input_text}'")
+                memory.save_context({"input": input_text}, {"output": cached})
+                if on_token is not None:
+                    on_token(cached)
+                response = cached
+            else:
+                tool_tracker.reset()
+                with telemetry.span("agent.run", source=source):
+                    response = agent_chain.run(input=input_text)
+                if answer_cache is not None and not tool_tracker.used & time_sensitive_tools:
+                    answer_cache.store(query_vector, response)
+        finally:
+            stream_handler.listener = None
+            stream_handler.cancel_event = None
+    if compactor is not None:
+        compactor.after_turn()
+    for listener in list(turn_listeners):
+        listener(source, input_text, response)
+    return response
+
+def recover_from_overflow():
+    # Last resort when a call still goes over the context length, keeps the pinned context and the summary
+    if compactor is not None:
+        compactor.recover()
+    else:
+        with agent_lock:
+            memory.chat_memory.clear()
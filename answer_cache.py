@@ -0,0 +1,79 @@
+# Semantic answer cache in front of the agent
+# Past questions are kept as unit-normalized embeddings in a preallocated NumPy matrix, so a lookup is one embedding
+# and one matrix-vector product. A new question whose cosine similarity to a stored one is above the threshold gets
+# the stored answer without running the agent. Entries expire after a TTL and the least recently used one makes room
+
+import time
+import threading
+import configparser
+
+import numpy as np
+
+class AnswerCacheSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.enabled = config.getboolean("answer_cache", "enabled", fallback=False)
+        self.threshold = config.getfloat("answer_cache", "threshold", fallback=0.95)
+        self.ttl = config.getint("answer_cache", "ttl", fallback=86400)
+        self.max_entries = config.getint("answer_cache", "max_entries", fallback=500)
+        # Answers that used any of these tools are never cached, Zapier covers every Zapier action
+        exclude_tools = config.get("answer_cache", "exclude_tools", fallback="Search, Weather, Zapier")
+        self.exclude_tools = {name.strip() for name in exclude_tools.split(",") if name.strip()}
+
+class AnswerCache:
+    def __init__(self, embeddings, threshold=0.95, ttl=86400, max_entries=500):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.matrix = None
+        self.expires_at = np.zeros(max_entries)
+        self.last_used = np.zeros(max_entries)
+        self.answers = [None] * max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, embeddings, settings):
+        if not settings.enabled:
+            return None
+        return cls(embeddings, settings.threshold, settings.ttl, settings.max_entries)
+
+    def embed(self, query):
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def lookup(self, vector):
+        # Returns the cached answer or None, expired rows have expires_at in the past and never match
+        now = time.time()
+        with self.lock:
+            if self.matrix is not None:
+                scores = self.matrix @ vector
+                scores[self.expires_at <= now] = -1.0
+                row = int(np.argmax(scores))
+                if scores[row] >= self.threshold:
+                    self.last_used[row] = now
+                    self.hits += 1
+                    return self.answers[row]
+            self.misses += 1
+            return None
+
+    def store(self, vector, answer):
+        now = time.time()
+        with self.lock:
+            if self.matrix is None:
+                self.matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            # Empty and expired rows go first, otherwise the least recently used
+            free = np.flatnonzero(self.expires_at <= now)
+            row = int(free[0]) if free.size else int(np.argmin(self.last_used))
+            self.matrix[row] = vector
+            self.expires_at[row] = now + self.ttl
+            self.last_used[row] = now
+            self.answers[row] = answer
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
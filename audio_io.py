@@ -0,0 +1,24 @@
+# Helpers for passing audio between the microphone, Whisper, Bark and pygame without writing temp files
+
+import io
+import wave
+
+import numpy as np
+import pygame.mixer
+
+WHISPER_SAMPLE_RATE = 16000
+
+def array_to_wav_bytes(audio_array, sample_rate):
+    pcm = (np.clip(audio_array, -1.0, 1.0) * 32767).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+    buffer.seek(0)
+    return buffer
+
+def array_to_sound(audio_array, sample_rate):
+    # Loading through an in-memory WAV lets SDL resample to whatever format the mixer was opened with
+    return pygame.mixer.Sound(file=array_to_wav_bytes(audio_array, sample_rate))
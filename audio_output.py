@@ -0,0 +1,167 @@
+# Non-blocking audio output
+# Clips are played by one thread from a priority queue on a reserved mixer channel, so callers only block when they
+# choose to wait for a clip. Chimes are loaded once as Sounds. With barge-in on, the microphone ring buffer is watched
+# while the assistant speaks, and as soon as the user starts talking playback stops and listeners are told the chunk
+# index where the speech began, so capture can pick up from there
+
+import heapq
+import itertools
+import threading
+import configparser
+
+import pygame.mixer
+
+from microphone import chunk_rms
+from telemetry import Telemetry
+
+PRIORITY_CHIME = 0
+PRIORITY_SPEECH = 1
+
+class AudioOutputSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        # Barge-in needs headphones or a microphone with echo cancellation, otherwise the assistant interrupts itself
+        self.barge_in = config.getboolean("audio_output", "barge_in", fallback=False)
+        self.barge_in_ratio = config.getfloat("audio_output", "barge_in_ratio", fallback=4.0)
+        self.barge_in_min_energy = config.getfloat("audio_output", "barge_in_min_energy", fallback=600)
+        # Seconds of continuous speech before playback is cut off
+        self.barge_in_min_speech = config.getfloat("audio_output", "barge_in_min_speech", fallback=0.25)
+
+class Clip:
+    def __init__(self, sound, priority, name=None):
+        self.sound = sound
+        self.priority = priority
+        self.name = name
+        self.interrupted = False
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        # True if the clip played to the end, False if it was stopped or is still playing after timeout
+        return self.done.wait(timeout) and not self.interrupted
+
+class AudioOutput:
+    def __init__(self, microphone=None, barge_in=False, barge_in_ratio=4.0, barge_in_min_energy=600, barge_in_min_speech=0.25, telemetry=None):
+        self.microphone = microphone
+        self.barge_in = barge_in and microphone is not None
+        self.barge_in_ratio = barge_in_ratio
+        self.barge_in_min_energy = barge_in_min_energy
+        self.barge_in_min_speech = barge_in_min_speech
+        self.telemetry = telemetry or Telemetry()
+        self.sounds = {}
+        self.queue = []
+        self.order = itertools.count()
+        self.current = None
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.listening = threading.Event()
+        self.barge_in_listeners = []
+        self.barge_in_index = None
+
+        # Keep channel 0 out of pygame's automatic channel selection so nothing else cuts into the output
+        pygame.mixer.set_reserved(1)
+        self.channel = pygame.mixer.Channel(0)
+
+        threading.Thread(target=self._play_loop, daemon=True).start()
+        if self.barge_in:
+            threading.Thread(target=self._watch_loop, daemon=True).start()
+
+    @classmethod
+    def from_settings(cls, microphone, settings, telemetry=None):
+        return cls(microphone, settings.barge_in, settings.barge_in_ratio, settings.barge_in_min_energy, settings.barge_in_min_speech, telemetry)
+
+    def preload(self, *file_paths):
+        for file_path in file_paths:
+            if file_path not in self.sounds:
+                self.sounds[file_path] = pygame.mixer.Sound(file_path)
+
+    def play(self, sound, priority=PRIORITY_SPEECH):
+        # sound is a pygame Sound or the path of a file, paths are loaded once and kept. Returns the queued Clip
+        name = None
+        if isinstance(sound, str):
+            name = sound
+            self.preload(sound)
+            sound = self.sounds[sound]
+        clip = Clip(sound, priority, name)
+        with self.condition:
+            heapq.heappush(self.queue, (priority, next(self.order), clip))
+            self.condition.notify_all()
+        return clip
+
+    def stop(self):
+        # Drops everything queued and cuts off the clip that is playing
+        with self.condition:
+            clips = [clip for _, _, clip in self.queue]
+            self.queue.clear()
+            if self.current is not None:
+                clips.append(self.current)
+                self.stopped.set()
+            self.condition.notify_all()
+        for clip in clips:
+            clip.interrupted = True
+            clip.done.set()
+
+    def wait_until_idle(self):
+        with self.condition:
+            while self.current is not None or self.queue:
+                self.condition.wait()
+
+    def _play_loop(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                _, _, clip = heapq.heappop(self.queue)
+                self.current = clip
+                self.stopped.clear()
+            with self.telemetry.span("audio.play", clip=clip.name or "speech") as span:
+                self.channel.play(clip.sound)
+                # Event.wait doubles as the poll interval and returns at once when stop() is called
+                while self.channel.get_busy():
+                    if self.stopped.wait(0.01):
+                        self.channel.stop()
+                        break
+                span["interrupted"] = clip.interrupted
+            with self.condition:
+                self.current = None
+                self.condition.notify_all()
+            clip.done.set()
+
+    def listen_while_speaking(self, active):
+        # Turns the barge-in watch on for the length of a response, a no-op unless barge-in is enabled
+        if not self.barge_in:
+            return
+        if active:
+            self.barge_in_index = None
+            self.listening.set()
+        else:
+            self.listening.clear()
+
+    def take_barge_in(self):
+        # Chunk index where the user started talking over the last response, or None, cleared once taken
+        index, self.barge_in_index = self.barge_in_index, None
+        return index
+
+    def _watch_loop(self):
+        min_speech = max(1, int(self.barge_in_min_speech / self.microphone.chunk_seconds))
+        while True:
+            self.listening.wait()
+            cursor = self.microphone.cursor()
+            voiced = 0
+            while self.listening.is_set():
+                chunk, index = self.microphone.read(cursor, timeout=0.1)
+                if chunk is None:
+                    if not self.microphone.running:
+                        self.listening.clear()
+                    continue
+                cursor = index + 1
+                threshold = self.microphone.energy_threshold(self.barge_in_ratio, self.barge_in_min_energy)
+                voiced = voiced + 1 if chunk_rms(chunk) > threshold else 0
+                if voiced >= min_speech:
+                    self.listening.clear()
+                    self.barge_in_index = index - voiced + 1
+                    self.telemetry.count("audio.barge_in")
+                    self.stop()
+                    for listener in list(self.barge_in_listeners):
+                        listener(self.barge_in_index)
@@ -0,0 +1,238 @@
+# Bark synthesis engine and worker process
+# Bark is imported and its models loaded in a separate process, so the voice loop never pays for the import or the
+# GIL-heavy parts of generation. A request is a list of text batches and the audio comes back one batch at a time,
+# so a long answer starts playing after its first batch. Voice prompts are loaded once per process and reused
+
+import os
+import sys
+import time
+import queue
+import atexit
+import itertools
+import threading
+import subprocess
+from collections import deque
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+class BarkEngine:
+    def __init__(self, small_models=False, offload_cpu=False, use_gpu=True):
+        self.small_models = small_models
+        self.offload_cpu = offload_cpu
+        self.use_gpu = use_gpu
+        self.prompts = {}
+        self.generate_audio = None
+        self.sample_rate = None
+
+    def load(self):
+        # Bark reads these when it's first imported and treats any non-empty value as on, even "False"
+        for name, enabled in (("SUNO_USE_SMALL_MODELS", self.small_models), ("SUNO_OFFLOAD_CPU", self.offload_cpu)):
+            if enabled:
+                os.environ[name] = "1"
+            else:
+                os.environ.pop(name, None)
+        from bark import SAMPLE_RATE, generate_audio, preload_models
+        try:
+            import torchaudio
+            torchaudio.set_audio_backend("soundfile")
+        except (ImportError, AttributeError, RuntimeError):
+            pass
+        preload_models(
+            text_use_gpu=self.use_gpu, text_use_small=self.small_models,
+            coarse_use_gpu=self.use_gpu, coarse_use_small=self.small_models,
+            fine_use_gpu=self.use_gpu, fine_use_small=self.small_models,
+            codec_use_gpu=self.use_gpu,
+        )
+        self.generate_audio = generate_audio
+        self.sample_rate = SAMPLE_RATE
+
+    def prompt(self, history_prompt):
+        # generate_audio loads the .npz of a named voice on every call, the arrays are kept here instead
+        if history_prompt not in self.prompts:
+            try:
+                from bark.generation import _load_history_prompt
+                loaded = _load_history_prompt(history_prompt)
+                self.prompts[history_prompt] = {key: np.asarray(loaded[key]) for key in ("semantic_prompt", "coarse_prompt", "fine_prompt")}
+            except (ImportError, KeyError, ValueError, OSError):
+                # Older Bark builds only take the name
+                self.prompts[history_prompt] = history_prompt
+        return self.prompts[history_prompt]
+
+    def generate(self, text, history_prompt):
+        audio = self.generate_audio(text, history_prompt=self.prompt(history_prompt), silent=True)
+        if isinstance(audio, tuple):
+            audio = audio[0]
+        return np.asarray(audio, dtype=np.float32)
+
+def batch_sentences(sentences, max_chars):
+    # The first sentence goes out on its own so playback can start early, the rest are packed into passes of up to
+    # max_chars, one Bark pass covers roughly 13 seconds of speech
+    batches = []
+    for sentence in sentences:
+        if len(batches) > 1 and len(batches[-1]) + 1 + len(sentence) <= max_chars:
+            batches[-1] = f"{batches[-1]} {sentence}"
+        else:
+            batches.append(sentence)
+    return batches
+
+def serve():
+    # Worker side, started as its own script so the spawned interpreter never imports main.py. The port goes out on
+    # stdout, after that stdout is pointed at stderr so Bark's own output can't fill a pipe nobody reads
+    listener = Listener(("127.0.0.1", 0), authkey=bytes.fromhex(os.environ["BARK_WORKER_AUTHKEY"]))
+    print(listener.address[1], flush=True)
+    os.dup2(2, 1)
+    connection = listener.accept()
+    engine = BarkEngine(**connection.recv())
+    try:
+        engine.load()
+    except Exception as e:
+        connection.send(("failed", None, repr(e)))
+        return
+    connection.send(("ready", None, engine.sample_rate))
+
+    pending = deque()
+    cancelled = set()
+
+    def receive(block):
+        # Returns False once the parent asked the worker to stop or went away
+        while block or connection.poll():
+            block = False
+            try:
+                message = connection.recv()
+            except EOFError:
+                return False
+            if message is None:
+                return False
+            kind, request_id, payload = message
+            if kind == "cancel":
+                cancelled.add(request_id)
+            else:
+                pending.append((request_id, payload))
+        return True
+
+    while True:
+        if not pending and not receive(True):
+            return
+        request_id, (batches, history_prompt) = pending.popleft()
+        try:
+            for batch in batches:
+                if not receive(False):
+                    return
+                if request_id in cancelled:
+                    break
+                start = time.perf_counter()
+                audio = engine.generate(batch, history_prompt)
+                connection.send(("chunk", request_id, (audio, time.perf_counter() - start)))
+        except Exception as e:
+            connection.send(("error", request_id, repr(e)))
+        cancelled.discard(request_id)
+        connection.send(("done", request_id, None))
+
+class BarkProcess:
+    def __init__(self, small_models=False, offload_cpu=False, use_gpu=True):
+        self.engine_options = {"small_models": small_models, "offload_cpu": offload_cpu, "use_gpu": use_gpu}
+        self.ids = itertools.count()
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.sample_rate = None
+        self.error = None
+        self.process = None
+        self.connection = None
+
+    def start(self):
+        authkey = os.urandom(16)
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdout=subprocess.PIPE,
+            env={**os.environ, "BARK_WORKER_AUTHKEY": authkey.hex()},
+        )
+        line = self.process.stdout.readline()
+        if not line:
+            self.error = f"worker exited with code {self.process.wait()}"
+            self.ready.set()
+            return self
+        self.connection = Client(("127.0.0.1", int(line)), authkey=authkey)
+        self._send(self.engine_options)
+        threading.Thread(target=self._read_results, daemon=True).start()
+        atexit.register(self.close)
+        return self
+
+    def wait_ready(self):
+        self.ready.wait()
+        if self.error is not None:
+            raise RuntimeError(f"Bark worker failed to start: {self.error}")
+
+    def _send(self, message):
+        with self.send_lock:
+            self.connection.send(message)
+
+    def _read_results(self):
+        while True:
+            try:
+                kind, request_id, payload = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            if kind in ("ready", "failed"):
+                if kind == "ready":
+                    self.sample_rate = payload
+                else:
+                    self.error = payload
+                self.ready.set()
+                continue
+            with self.lock:
+                stream = self.streams.get(request_id)
+            if stream is not None:
+                stream.put((kind, payload))
+        # The worker is gone, nothing that's waiting on it should hang
+        if self.error is None:
+            self.error = "worker exited"
+        self.ready.set()
+        with self.lock:
+            streams = list(self.streams.values())
+        for stream in streams:
+            stream.put(("error", self.error))
+
+    def generate(self, batches, history_prompt):
+        # Yields (samples, sample rate, seconds spent generating) for each batch as soon as it's ready
+        self.wait_ready()
+        request_id = next(self.ids)
+        stream = queue.Queue()
+        with self.lock:
+            self.streams[request_id] = stream
+        self._send(("generate", request_id, (batches, history_prompt)))
+        try:
+            while True:
+                kind, payload = stream.get()
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise RuntimeError(f"Bark worker error: {payload}")
+                audio, seconds = payload
+                yield audio, self.sample_rate, seconds
+        finally:
+            with self.lock:
+                self.streams.pop(request_id, None)
+
+    def cancel(self):
+        # Skips the remaining batches of every request in flight, a batch being generated still finishes
+        with self.lock:
+            request_ids = list(self.streams)
+        for request_id in request_ids:
+            self._send(("cancel", request_id, None))
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self._send(None)
+            except (OSError, AttributeError):
+                pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,237 @@
+# Local calculator tool
+# Expressions are parsed with Python's ast module and evaluated over a whitelist of operators, constants and math
+# functions, so nothing in the input is ever executed. "5 miles in km" style unit conversions are handled too.
+# Only input that can't be parsed is handed to the fallback (LLMMathChain), which costs an LLM round trip
+
+import re
+import ast
+import math
+import operator
+
+class CalculatorError(ValueError):
+    pass
+
+# Input the calculator doesn't understand, as opposed to a valid expression with no answer like 1/0
+class CalculatorParseError(CalculatorError):
+    pass
+
+def _power(base, exponent):
+    # Keep a typo like 9**9**9 from hanging the assistant
+    if abs(exponent) > 1000 and abs(base) > 1:
+        raise CalculatorError("exponent too large")
+    return operator.pow(base, exponent)
+
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _power,
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+
+def _factorial(x):
+    if x != int(x) or not 0 <= x <= 170:
+        raise CalculatorError("factorial needs a whole number between 0 and 170")
+    return math.factorial(int(x))
+
+FUNCTIONS = {
+    "sqrt": math.sqrt, "cbrt": lambda x: math.copysign(abs(x) ** (1 / 3), x), "exp": math.exp,
+    "log": math.log, "ln": math.log, "log10": math.log10, "log2": math.log2,
+    "sin": math.sin, "cos": math.cos, "tan": math.tan, "asin": math.asin, "acos": math.acos, "atan": math.atan,
+    "sinh": math.sinh, "cosh": math.cosh, "tanh": math.tanh, "degrees": math.degrees, "radians": math.radians,
+    "abs": abs, "round": round, "floor": math.floor, "ceil": math.ceil, "factorial": _factorial,
+    "min": min, "max": max, "pow": _power, "hypot": math.hypot,
+}
+
+# Each unit maps to (dimension, factor to the dimension's base unit), temperatures are converted separately
+UNITS = {}
+def _units(dimension, factor, *names):
+    for name in names:
+        UNITS[name] = (dimension, factor)
+
+_units("length", 1.0, "m", "meter", "meters", "metre", "metres")
+_units("length", 1000.0, "km", "kilometer", "kilometers", "kilometre", "kilometres")
+_units("length", 0.01, "cm", "centimeter", "centimeters", "centimetre", "centimetres")
+_units("length", 0.001, "mm", "millimeter", "millimeters", "millimetre", "millimetres")
+_units("length", 0.0254, "in", "inch", "inches")
+_units("length", 0.3048, "ft", "foot", "feet")
+_units("length", 0.9144, "yd", "yard", "yards")
+_units("length", 1609.344, "mi", "mile", "miles")
+_units("length", 1852.0, "nmi", "nautical mile", "nautical miles")
+_units("mass", 1.0, "kg", "kilogram", "kilograms", "kilo", "kilos")
+_units("mass", 0.001, "g", "gram", "grams")
+_units("mass", 1e-6, "mg", "milligram", "milligrams")
+_units("mass", 1000.0, "t", "tonne", "tonnes", "metric ton", "metric tons")
+_units("mass", 0.45359237, "lb", "lbs", "pound", "pounds")
+_units("mass", 0.028349523125, "oz", "ounce", "ounces")
+_units("mass", 6.35029318, "st", "stone", "stones")
+_units("volume", 1.0, "l", "liter", "liters", "litre", "litres")
+_units("volume", 0.001, "ml", "milliliter", "milliliters", "millilitre", "millilitres")
+_units("volume", 3.785411784, "gal", "gallon", "gallons")
+_units("volume", 0.946352946, "qt", "quart", "quarts")
+_units("volume", 0.473176473, "pt", "pint", "pints")
+_units("volume", 0.2365882365, "cup", "cups")
+_units("volume", 0.0295735295625, "fl oz", "fluid ounce", "fluid ounces")
+_units("volume", 0.01478676478125, "tbsp", "tablespoon", "tablespoons")
+_units("volume", 0.00492892159375, "tsp", "teaspoon", "teaspoons")
+_units("time", 1.0, "s", "sec", "second", "seconds")
+_units("time", 60.0, "min", "minute", "minutes")
+_units("time", 3600.0, "h", "hr", "hour", "hours")
+_units("time", 86400.0, "day", "days")
+_units("time", 604800.0, "week", "weeks")
+_units("time", 31557600.0, "year", "years")
+_units("speed", 1.0, "m/s", "meters per second", "metres per second")
+_units("speed", 1 / 3.6, "km/h", "kph", "kmh", "kilometers per hour", "kilometres per hour")
+_units("speed", 0.44704, "mph", "miles per hour")
+_units("speed", 0.514444, "knot", "knots")
+_units("area", 1.0, "m2", "square meter", "square meters", "square metre", "square metres")
+_units("area", 0.09290304, "ft2", "square foot", "square feet")
+_units("area", 1e6, "km2", "square kilometer", "square kilometers", "square kilometre", "square kilometres")
+_units("area", 2589988.110336, "mi2", "square mile", "square miles")
+_units("area", 4046.8564224, "acre", "acres")
+_units("area", 10000.0, "ha", "hectare", "hectares")
+_units("data", 1.0, "b", "byte", "bytes")
+_units("data", 1e3, "kb", "kilobyte", "kilobytes")
+_units("data", 1e6, "mb", "megabyte", "megabytes")
+_units("data", 1e9, "gb", "gigabyte", "gigabytes")
+_units("data", 1e12, "tb", "terabyte", "terabytes")
+_units("energy", 1.0, "j", "joule", "joules")
+_units("energy", 4184.0, "kcal", "calorie", "calories", "kilocalorie", "kilocalories")
+_units("energy", 3.6e6, "kwh", "kilowatt hour", "kilowatt hours")
+
+TEMPERATURES = {
+    "c": "c", "celsius": "c", "degrees celsius": "c", "°c": "c",
+    "f": "f", "fahrenheit": "f", "degrees fahrenheit": "f", "°f": "f",
+    "k": "k", "kelvin": "k", "kelvins": "k",
+}
+
+CONVERSION = re.compile(r"^(?P<value>.*?[\d)])\s*(?P<source>[a-z°][a-z°/ 0-9]*?)\s+(?:to|in|into|as)\s+(?P<target>[a-z°][a-z°/ 0-9]*)$")
+
+# Spoken and written forms the agent tends to pass along, applied in order
+REWRITES = [
+    (re.compile(r"^(what is|what's|whats|calculate|compute|evaluate|how much is|convert)\s+"), ""),
+    (re.compile(r"[?!]+$"), ""),
+    (re.compile(r"(\d),(\d{3})"), r"\1\2"),
+    (re.compile(r"\bsquare root of\b"), "sqrt"),
+    (re.compile(r"\bto the power of\b"), "**"),
+    (re.compile(r"\bmultiplied by\b|\btimes\b|×"), "*"),
+    (re.compile(r"\bdivided by\b|÷"), "/"),
+    (re.compile(r"\bplus\b"), "+"),
+    (re.compile(r"\bminus\b"), "-"),
+    (re.compile(r"\bmod\b|\bmodulo\b"), "%"),
+    (re.compile(r"(\d+(?:\.\d+)?)\s*% of\b"), r"(\1/100)*"),
+    (re.compile(r"(\d+(?:\.\d+)?)\s*percent of\b"), r"(\1/100)*"),
+    (re.compile(r"\^"), "**"),
+]
+
+def normalize(expression):
+    expression = " ".join(expression.strip().lower().split())
+    for pattern, replacement in REWRITES:
+        expression = pattern.sub(replacement, expression)
+    return expression.strip()
+
+# Whole numbers past this many bits are refused, every step stays fast and the answer can still be printed
+MAX_INT_BITS = 4000
+
+def _check_size(value):
+    if isinstance(value, int) and value.bit_length() > MAX_INT_BITS:
+        raise CalculatorError("result too large")
+    return value
+
+def _evaluate(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return node.value
+    if isinstance(node, ast.Name) and node.id in CONSTANTS:
+        return CONSTANTS[node.id]
+    if isinstance(node, ast.UnaryOp) and type(node.op) in OPERATORS:
+        return OPERATORS[type(node.op)](_evaluate(node.operand))
+    if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+        return _check_size(OPERATORS[type(node.op)](_evaluate(node.left), _evaluate(node.right)))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS and not node.keywords:
+        return _check_size(FUNCTIONS[node.func.id](*[_evaluate(arg) for arg in node.args]))
+    raise CalculatorParseError(f"unsupported expression: {ast.dump(node)[:60]}")
+
+def evaluate(expression):
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e:
+        raise CalculatorParseError(f"could not parse {expression!r}") from e
+    try:
+        return _evaluate(tree)
+    except (ArithmeticError, TypeError, ValueError) as e:
+        if isinstance(e, CalculatorError):
+            raise
+        raise CalculatorError(str(e)) from e
+
+def is_calculation(query):
+    # True for a unit conversion or an expression with an operator or function call, a bare number like "1984" is
+    # more likely a year or a title than something to work out
+    expression = normalize(query)
+    if CONVERSION.match(expression):
+        return True
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        return False
+    return any(isinstance(node, (ast.BinOp, ast.Call)) for node in ast.walk(tree))
+
+def convert_temperature(value, source, target):
+    celsius = {"c": value, "f": (value - 32) * 5 / 9, "k": value - 273.15}[source]
+    return {"c": celsius, "f": celsius * 9 / 5 + 32, "k": celsius + 273.15}[target]
+
+def convert(expression):
+    # Returns (value, target unit) for "<expression> <unit> to <unit>", or None if it isn't a conversion
+    match = CONVERSION.match(expression)
+    if not match:
+        return None
+    source = match.group("source").strip()
+    target = match.group("target").strip()
+    value = evaluate(match.group("value"))
+    if source in TEMPERATURES and target in TEMPERATURES:
+        return convert_temperature(value, TEMPERATURES[source], TEMPERATURES[target]), target
+    if source not in UNITS or target not in UNITS:
+        raise CalculatorParseError(f"unknown unit in {expression!r}")
+    source_dimension, source_factor = UNITS[source]
+    target_dimension, target_factor = UNITS[target]
+    if source_dimension != target_dimension:
+        raise CalculatorError(f"can't convert {source_dimension} to {target_dimension}")
+    return value * source_factor / target_factor, target
+
+def format_number(value):
+    try:
+        if isinstance(value, int) or (isinstance(value, float) and value.is_integer() and abs(value) < 1e15):
+            return str(int(value))
+        return f"{value:.10g}"
+    except (ValueError, OverflowError) as e:
+        raise CalculatorError(str(e)) from e
+
+class LocalCalculator:
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+
+    def calculate(self, query):
+        expression = normalize(query)
+        converted = convert(expression)
+        if converted is not None:
+            value, unit = converted
+            return f"Answer: {format_number(value)} {unit}"
+        return f"Answer: {format_number(evaluate(expression))}"
+
+    def run(self, query):
+        try:
+            return self.calculate(query)
+        except CalculatorParseError as e:
+            if self.fallback is None:
+                return f"Could not calculate that: {e}"
+            print(f"Local calculator could not handle '{query}' ({e}), asking the LLM")
+            return self.fallback(query)
+        except CalculatorError as e:
+            return f"Could not calculate that: {e}"
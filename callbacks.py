@@ -0,0 +1,178 @@
+# LangChain callback handlers
+# The pinned LangChain version declares every callback as abstract, so handlers start from a class that ignores them all
+
+import re
+import time
+import threading
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+class NoOpCallbackHandler(BaseCallbackHandler):
+    @property
+    def always_verbose(self):
+        return True
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        pass
+
+    def on_llm_new_token(self, token, **kwargs):
+        pass
+
+    def on_llm_end(self, response, **kwargs):
+        pass
+
+    def on_llm_error(self, error, **kwargs):
+        pass
+
+    def on_chain_start(self, serialized, inputs, **kwargs):
+        pass
+
+    def on_chain_end(self, outputs, **kwargs):
+        pass
+
+    def on_chain_error(self, error, **kwargs):
+        pass
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        pass
+
+    def on_tool_end(self, output, **kwargs):
+        pass
+
+    def on_tool_error(self, error, **kwargs):
+        pass
+
+    def on_text(self, text, **kwargs):
+        pass
+
+    def on_agent_action(self, action, **kwargs):
+        pass
+
+    def on_agent_finish(self, finish, **kwargs):
+        pass
+
+FINAL_ANSWER = re.compile(r'"action"\s*:\s*"Final Answer"')
+ACTION_INPUT = re.compile(r'"action_input"\s*:\s*"')
+ESCAPES = {"n": "\n", "t": " ", "r": "", "b": "", "f": ""}
+
+class RunCancelled(Exception):
+    pass
+
+# The conversational agent answers with a JSON blob, this pulls the text of "action_input" out of the token
+# stream once the action is "Final Answer" and hands it to the listener piece by piece
+# Setting cancel_event aborts the run at the next LLM call or token
+class FinalAnswerStreamHandler(NoOpCallbackHandler):
+    def __init__(self):
+        self.listener = None
+        self.cancel_event = None
+        self.reset()
+
+    def reset(self):
+        self.buffer = ""
+        self.position = None
+        self.done = False
+
+    def check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise RunCancelled()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.check_cancelled()
+        self.reset()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.check_cancelled()
+        if self.listener is None or self.done:
+            return
+        self.buffer += token
+        if self.position is None:
+            if not FINAL_ANSWER.search(self.buffer):
+                return
+            match = ACTION_INPUT.search(self.buffer)
+            if not match:
+                return
+            self.position = match.end()
+        text = self.decode()
+        if text:
+            self.listener(text)
+
+    def decode(self):
+        # Decode the JSON string as far as it has arrived, stopping before an incomplete escape sequence
+        text = []
+        i = self.position
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char != "\\":
+                text.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(self.buffer):
+                break
+            escaped = self.buffer[i + 1]
+            if escaped == "u":
+                if i + 6 > len(self.buffer):
+                    break
+                try:
+                    text.append(chr(int(self.buffer[i + 2:i + 6], 16)))
+                except ValueError:
+                    pass
+                i += 6
+                continue
+            text.append(ESCAPES.get(escaped, escaped))
+            i += 2
+        self.position = i
+        return "".join(text)
+
+# Times every LLM call on the model it is attached to, with time to first token and token counts
+# Streaming responses don't report usage in this LangChain version, so completion tokens are counted as they stream
+class TelemetryCallbackHandler(NoOpCallbackHandler):
+    def __init__(self, telemetry, name="llm"):
+        self.telemetry = telemetry
+        self.name = name
+        self.calls = {}
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.calls[threading.get_ident()] = {"start": time.perf_counter(), "first_token": None, "tokens": 0, "prompt_chars": sum(len(prompt) for prompt in prompts)}
+
+    def on_llm_new_token(self, token, **kwargs):
+        call = self.calls.get(threading.get_ident())
+        if call is None:
+            return
+        if call["first_token"] is None:
+            call["first_token"] = time.perf_counter() - call["start"]
+        call["tokens"] += 1
+
+    def on_llm_end(self, response, **kwargs):
+        call = self.calls.pop(threading.get_ident(), None)
+        if call is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        completion_tokens = usage.get("completion_tokens", call["tokens"])
+        attributes = {"completion_tokens": completion_tokens, "prompt_chars": call["prompt_chars"]}
+        if "prompt_tokens" in usage:
+            attributes["prompt_tokens"] = usage["prompt_tokens"]
+        if call["first_token"] is not None:
+            attributes["first_token_ms"] = round(call["first_token"] * 1000, 1)
+            self.telemetry.record(f"{self.name}.first_token", call["first_token"])
+        self.telemetry.record(self.name, time.perf_counter() - call["start"], **attributes)
+        self.telemetry.count(f"{self.name}.completion_tokens", completion_tokens)
+
+    def on_llm_error(self, error, **kwargs):
+        call = self.calls.pop(threading.get_ident(), None)
+        if call is not None:
+            self.telemetry.record(self.name, time.perf_counter() - call["start"], error=type(error).__name__)
+
+# Remembers which tools the agent picked during a run, attach it to the agent executor's callback manager
+class ToolUseTracker(NoOpCallbackHandler):
+    def __init__(self):
+        self.used = set()
+
+    def reset(self):
+        self.used = set()
+
+    def on_agent_action(self, action, **kwargs):
+        self.used.add(action.tool)
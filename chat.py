@@ -1,188 +1,27 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinter.scrolledtext import ScrolledText
-import openai
 import os
 import sys
-from dotenv import load_dotenv, set_key
-from langchain.agents import Tool
-from langchain.memory import ConversationTokenBufferMemory, ReadOnlySharedMemory
-from langchain.chat_models import ChatOpenAI
-from langchain.utilities import GoogleSearchAPIWrapper, WikipediaAPIWrapper, WolframAlphaAPIWrapper, OpenWeatherMapAPIWrapper
-from langchain.agents import initialize_agent
-from langchain.chains import LLMMathChain, RetrievalQA
-from langchain.utilities.zapier import ZapierNLAWrapper
-from langchain.agents.agent_toolkits import ZapierToolkit
-from pathlib import Path
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import Pinecone
-import pinecone
-from langchain.chains.question_answering import load_qa_chain
-from langchain.chains.summarize import load_summarize_chain
+import queue
+import threading
+from dotenv import load_dotenv
 import traceback
-import configparser
 import tkinter
 from tkinter import ttk, Toplevel, messagebox
 import sv_ttk
 
-config = configparser.ConfigParser()
-config.read("settings.ini")
-bot_name = config.get("settings", "bot_name")
-BOT_NAME = bot_name
+# The agent core is shared with main.py, when the chat window is opened from the voice assistant it joins that session
+from agent import config, BOT_NAME, agent_chain, run_agent, recover_from_overflow, turn_listeners, conversation_store
+from callbacks import RunCancelled
 
 def restart_app():
+    # os.execl skips atexit, so queued turns are written out and the session released before the process is replaced
+    if conversation_store is not None:
+        conversation_store.close()
     python = sys.executable
     os.execl(python, python, *sys.argv)
 
-class SearchSettings:
-    def __init__(self, file_path="settings.ini"):
-        config = configparser.ConfigParser()
-        config.read(file_path)
-
-        self.enable_search = config.getboolean("tools", "enable_search")
-        self.enable_wikipedia = config.getboolean("tools", "enable_wikipedia")
-        self.enable_calculator = config.getboolean("tools", "enable_calculator")
-        self.enable_wolfram_alpha = config.getboolean("tools", "enable_wolfram_alpha")
-        self.enable_weather = config.getboolean("tools", "enable_weather")
-        self.enable_zapier = config.getboolean("tools", "enable_zapier")
-        self.enable_pinecone = config.getboolean("tools", "enable_pinecone")
-
-# Initialize variables
-env_path = Path(__file__).parent / ".env"
-load_dotenv(dotenv_path=env_path)
-openai.api_key = os.getenv("OPENAI_API_KEY")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-GOOGLE_CSE_ID = os.getenv("GOOGLE_CSE_ID")
-WOLFROM_ALPHA_APPID = os.getenv("WOLFROM_ALPHA_APPID")
-OPENWEATHERMAP_API_KEY = os.getenv("OPENWEATHERMAP_API_KEY")
-ZAPIER_NLA_API_KEY = os.getenv("ZAPIER_NLA_API_KEY")
-PINE_API_KEY = os.getenv("PINE_API_KEY")
-PINE_ENV = os.getenv("PINE_ENV")
-
-# Initialize Pinecone
-embeddings = OpenAIEmbeddings()
-pinecone_env = config.get("pinecone", "pinecone_env")
-
-pinecone.init(
-    api_key=PINE_API_KEY,
-    environment=pinecone_env
-)
-
-index_name = config.get("pinecone", "pinecone_index")
-
-docsearch = Pinecone.from_existing_index(index_name, embeddings)
-
-settings = SearchSettings("settings.ini")
-
-# Define the memory and the LLM engine
-llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0.5, max_tokens=150, verbose=True)
-memory = ConversationTokenBufferMemory(llm=llm, max_token_limit=1500, memory_key="chat_history", return_messages=True)
-doc_chain = load_qa_chain(llm, chain_type="map_reduce")
-readonlymemory = ReadOnlySharedMemory(memory=memory)
-
-# Define the tools
-search = GoogleSearchAPIWrapper(k=2)
-wikipedia = WikipediaAPIWrapper()
-llm_math = LLMMathChain(llm=llm)
-wolfram_alpha = WolframAlphaAPIWrapper()
-weather = OpenWeatherMapAPIWrapper()
-zapier= ZapierNLAWrapper()
-toolkit = ZapierToolkit.from_zapier_nla_wrapper(zapier)
-retriever = docsearch.as_retriever(search_type="similarity", search_kwargs={"k":2})
-pinecone_tool = RetrievalQA.from_chain_type(llm=llm, chain_type="map_rerank", retriever=docsearch.as_retriever())
-wikisummarize = load_summarize_chain(llm, chain_type="stuff")
-
-class WikiPage:
-    def __init__(self, title, summary):
-        self.title = title
-        self.page_content = summary
-        self.metadata = {}
-
-def wiki_summary(search_query: str) -> str:
-    wikipedia_wrapper = wikipedia
-    wiki_result = wikipedia_wrapper.run(search_query)
-
-    if not wiki_result:
-        return "No good Wikipedia Search Result was found"
-
-    wiki_pages = []
-    for section in wiki_result.split("\n\n"):
-        title, summary = section.split("\nSummary: ", 1)
-        title = title.replace("Page: ", "")
-        wiki_pages.append(WikiPage(title=title, summary=summary))
-
-    summary_result = wikisummarize.run(wiki_pages)
-    return summary_result
-
-tools = []
-
-if settings.enable_search:
-    tools.append(
-        Tool(
-            name="Search",
-            func=search.run,
-            description="Useful when you need to answer questions about current events and real-time information"
-        )
-    )
-if settings.enable_wikipedia:
-    tools.append(
-        Tool(
-            name="Wikipedia",
-            func=wiki_summary,
-            description="Useful for searching information on historical information on Wikipedia. "
-            "Use this more than the normal search if the question is about events that occured before 2023, like the 'What was the 2008 financial crisis?' or 'Who won the 2016 US presidential election?'"
-        )
-    )
-if settings.enable_calculator:
-    tools.append(
-        Tool(
-            name='Calculator',
-            func=llm_math.run,
-            description='Useful for when you need to answer questions about math.'
-        )
-    )
-if settings.enable_wolfram_alpha:
-    tools.append(
-        Tool(
-            name='Wolfram Alpha',
-            func=wolfram_alpha.run,
-            description="Useful for when you need to answer questions about Math, "
-                        "Science, Technology, Culture, people, Society and Everyday Life. "
-                        "Input should be a search query"
-        )
-    )
-if settings.enable_weather:
-    tools.append(
-        Tool(
-            name='Weather',
-            func=weather.run,
-            description="Useful for when you need to answer questions about weather."
-        )
-    )
-# Adjust pinecone tool settings in settings.ini
-if settings.enable_pinecone:
-    pinecone_name = config.get("pinecone", "tool_name")
-    pinecone_description = config.get("pinecone", "tool_description")
-
-    tools.append(
-        Tool(
-            name=pinecone_name,
-            func=pinecone_tool.run,
-            description=pinecone_description
-        )
-    )
-
-bot_context = config.get("settings", "bot_context")
-CONTEXT = bot_context
-
-# Workaround so that the agent chain respects the Zapier settings since it uses a toolkit
-if settings.enable_zapier:
-    agent_chain = initialize_agent([*toolkit.get_tools(), *tools], llm, agent="chat-conversational-react-description", verbose=True, memory=memory)
-else:
-    agent_chain = initialize_agent(tools, llm, agent="chat-conversational-react-description", verbose=True, memory=memory)
-
-agent_chain.memory.chat_memory.add_ai_message(CONTEXT)
-
 #Define the Settings GUI
 def open_settings():
     settings_window = Toplevel()
@@ -202,6 +41,12 @@ def open_settings():
         config.set("pinecone", "pinecone_env", pinecone_env_var.get())
 
         config.set("voice", "use_bark", str(use_bark_var.get()))
+        # The voice assistant picks a new engine up from settings.ini on its next sentence, no restart needed
+        tts_backend = config.get("voice", "tts_backend", fallback="pyttsx3")
+        if use_bark_var.get():
+            config.set("voice", "tts_backend", "bark")
+        elif tts_backend == "bark":
+            config.set("voice", "tts_backend", "pyttsx3")
         config.set("voice", "history_prompt", history_prompt_var.get())
 
         with open("settings.ini", "w") as configfile:
@@ -368,42 +213,101 @@ def edit_api_keys():
 
 # Define the main function
 def main():
+    # Agent calls run on a worker thread so the window stays responsive, everything the worker wants to show
+    # goes through ui_events and is drawn by poll_events on the Tk thread
+    requests = queue.Queue()
+    ui_events = queue.Queue()
+    cancel_event = threading.Event()
+
     def on_submit():
         user_input = user_entry.get()
         user_entry.delete(0, tk.END)
 
         if user_input:
-            chat_history.config(state="normal")
-            chat_history.insert(tk.END, f"User: {user_input}\n")
-            chat_history.config(state="disabled")
-            chat_history.yview(tk.END)
-
-            root.update_idletasks()
-
-            agent_chain.memory.chat_memory.add_user_message(user_input)
-
+            show_message("User", user_input)
+            # Submissions made while the agent is busy wait their turn
+            requests.put(user_input)
+
+    def on_cancel():
+        cancel_event.set()
+
+    def process_requests():
+        while True:
+            user_input = requests.get()
+            if user_input is None:
+                return
+            cancel_event.clear()
+            ui_events.put(("start",))
+            streamed = []
+
+            def on_token(text):
+                streamed.append(text)
+                ui_events.put(("token", text))
+
+            failed = True
             try:
-                response = agent_chain.run(input=user_input)
+                response = run_agent(user_input, on_token=on_token, source="chat", cancel_event=cancel_event)
                 bot_response = response
+                failed = False
+            except RunCancelled:
+                bot_response = "Request cancelled."
             except Exception as e:
                 tb_string = traceback.format_exc()
 
                 if "This model's maximum context length is" in tb_string:
-                    agent_chain.memory.chat_memory.clear()
+                    recover_from_overflow()
                     bot_response = (
-                        "Apologies, the last request went over the maximum context length so I have to clear my memory. Is there anything else I can help you with?"
+                        "Apologies, the last request went over the maximum context length so I had to forget the older part of our conversation. Is there anything else I can help you with?"
                     )
                 else:
                     traceback.print_exc()
 
                     bot_response = f"Apologies, An error occurred while processing your request: {str(e)}."
 
+            if not streamed:
+                ui_events.put(("done", bot_response))
+            elif failed:
+                ui_events.put(("done", f" [{bot_response}]"))
+            else:
+                ui_events.put(("done", ""))
+
+    def append_text(text):
         chat_history.config(state="normal")
-        chat_history.insert(tk.END, f"{BOT_NAME}: {bot_response}\n")
+        chat_history.insert(tk.END, text)
         chat_history.config(state="disabled")
         chat_history.yview(tk.END)
 
-        agent_chain.memory.chat_memory.add_ai_message(bot_response)
+    def show_message(speaker, text):
+        append_text(f"{speaker}: {text}\n")
+
+    def on_turn(source, user_input, response):
+        if source != "chat":
+            ui_events.put(("turn", user_input, response))
+
+    def poll_events():
+        while True:
+            try:
+                event = ui_events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "start":
+                append_text(f"{BOT_NAME}: ")
+                cancel_button.config(state="normal")
+            elif event[0] == "token":
+                append_text(event[1])
+            elif event[0] == "done":
+                append_text(f"{event[1]}\n")
+                cancel_button.config(state="disabled")
+            elif event[0] == "turn":
+                show_message("User", event[1])
+                show_message(BOT_NAME, event[2])
+        root.after(50, poll_events)
+
+    def on_close():
+        turn_listeners.remove(on_turn)
+        requests.put(None)
+        cancel_event.set()
+        root.destroy()
 
     root = tkinter.Tk()
     root.title(f"{BOT_NAME} Chatbot")
@@ -427,6 +331,8 @@ def main():
     settings_button.grid(row=0, column=2, padx=(5, 0))
     submit_button = ttk.Button(user_frame, text="Submit", command=on_submit)
     submit_button.grid(row=0, column=1, padx=(5, 0))
+    cancel_button = ttk.Button(user_frame, text="Cancel", command=on_cancel, state="disabled")
+    cancel_button.grid(row=0, column=3, padx=(5, 0))
 
     root.columnconfigure(0, weight=1)
     root.rowconfigure(0, weight=1)
@@ -435,6 +341,18 @@ def main():
     user_frame.columnconfigure(0, weight=5)
     user_frame.rowconfigure(0, weight=1)
 
+    # Show the conversation so far, the pinned bot context is a system message and is skipped
+    for message in agent_chain.memory.chat_memory.messages:
+        if message.type == "human":
+            show_message("User", message.content)
+        elif message.type == "ai":
+            show_message(BOT_NAME, message.content)
+
+    turn_listeners.append(on_turn)
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    root.after(50, poll_events)
+    threading.Thread(target=process_requests, daemon=True).start()
+
     sv_ttk.set_theme("dark")
 
     root.mainloop()
@@ -0,0 +1,97 @@
+# Background conversation compaction
+# After every turn the prompt for the next call is estimated from the agent's prompt template and tool descriptions,
+# the memory and a reserve for the tool scratchpad. Past the high-water mark the oldest turns are folded into a rolling
+# summary on a background thread, so the next call neither overflows nor waits on the summarizer.
+# If a turn comes in before the summary is ready, the oldest messages are dropped just enough for it to fit
+
+import threading
+import traceback
+import configparser
+
+from langchain.chains import LLMChain
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.schema import get_buffer_string
+
+class CompactionSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.enabled = config.getboolean("compaction", "enabled", fallback=True)
+        self.context_window = config.getint("compaction", "context_window", fallback=4096)
+        self.high_water = config.getfloat("compaction", "high_water", fallback=0.75)
+        self.scratchpad_reserve = config.getint("compaction", "scratchpad_reserve", fallback=1000)
+        self.keep_messages = config.getint("compaction", "keep_messages", fallback=2)
+
+class ConversationCompactor:
+    def __init__(self, memory, summary_llm, prompt, lock, context_window=4096, high_water=0.75, scratchpad_reserve=1000, keep_messages=2, response_tokens=256):
+        self.memory = memory
+        self.chain = LLMChain(llm=summary_llm, prompt=SUMMARY_PROMPT)
+        self.prompt = prompt
+        self.lock = lock
+        self.context_window = context_window
+        self.high_water = high_water
+        self.scratchpad_reserve = scratchpad_reserve
+        self.keep_messages = keep_messages
+        self.response_tokens = response_tokens
+        self.fixed_tokens = None
+        self.thread = None
+
+    @classmethod
+    def from_settings(cls, memory, summary_llm, prompt, lock, settings, response_tokens=256):
+        if not settings.enabled:
+            return None
+        return cls(memory, summary_llm, prompt, lock, settings.context_window, settings.high_water, settings.scratchpad_reserve, settings.keep_messages, response_tokens)
+
+    def prompt_tokens(self):
+        # The system prompt with the tool descriptions and format instructions doesn't change, count it once
+        if self.fixed_tokens is None:
+            messages = self.prompt.format_messages(input="", chat_history=[], agent_scratchpad=[])
+            self.fixed_tokens = self.memory.llm.get_num_tokens_from_messages(messages)
+        return self.fixed_tokens
+
+    def memory_budget(self, input_text=""):
+        # Tokens the memory can use without the call overflowing, capped by the memory's own limit
+        available = self.context_window - self.prompt_tokens() - self.scratchpad_reserve - self.response_tokens
+        if input_text:
+            available -= self.memory.llm.get_num_tokens(input_text)
+        return min(available, self.memory.max_token_limit)
+
+    def before_turn(self, input_text):
+        # Called with the agent lock held, right before the call
+        history = self.memory.chat_memory
+        budget = self.memory_budget(input_text)
+        if history.token_count() > budget:
+            print(f"Memory is over the prompt budget ({history.token_count()} > {budget} tokens), dropping the oldest messages")
+            history.trim(budget)
+
+    def after_turn(self):
+        if self.memory.chat_memory.token_count() <= self.high_water * self.memory_budget():
+            return
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self.compact, daemon=True)
+        self.thread.start()
+
+    def compact(self):
+        with self.lock:
+            history = self.memory.chat_memory
+            messages = history.oldest(history.conversation_tokens() // 2, self.keep_messages)
+            previous = history.summary_text
+        if not messages:
+            return
+
+        try:
+            summary = self.chain.predict(summary=previous, new_lines=get_buffer_string(messages))
+        except Exception:
+            traceback.print_exc()
+            return
+
+        with self.lock:
+            history.summarize(messages, summary.strip())
+        print(f"Compacted {len(messages)} messages into the conversation summary")
+
+    def recover(self):
+        # The call overflowed anyway (a huge tool result), keep the summary and the latest turn and drop the rest
+        with self.lock:
+            self.memory.chat_memory.keep_last(self.keep_messages)
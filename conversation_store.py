@@ -0,0 +1,156 @@
+# Persistent conversation store
+# Messages are kept in a WAL-mode SQLite file so the conversation survives restarts and can be read by another process
+# while this one writes. Writes are queued and committed in batches by a background thread, and loading only reads a
+# bounded tail of the session plus its latest summary, so startup doesn't grow with the size of the history.
+# A process claims the session it writes to and keeps the claim alive from the writer thread, so a second process
+# (chat.py on its own next to main.py) starts a session of its own instead of writing into the same sequence
+
+import os
+import time
+import uuid
+import queue
+import atexit
+import sqlite3
+import threading
+import configparser
+
+# A claim that hasn't been refreshed for this long belongs to a process that's gone
+CLAIM_TIMEOUT = 60
+HEARTBEAT_INTERVAL = 15
+
+class ConversationStoreSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.enabled = config.getboolean("conversation_store", "enabled", fallback=True)
+        self.sqlite_path = config.get("conversation_store", "sqlite_path", fallback="data/conversations.sqlite")
+        # Leave session_id empty to pick up the most recent session, or set resume_last_session to False to start fresh
+        self.session_id = config.get("conversation_store", "session_id", fallback="")
+        self.resume_last_session = config.getboolean("conversation_store", "resume_last_session", fallback=True)
+        self.tail_messages = config.getint("conversation_store", "tail_messages", fallback=40)
+
+class ConversationStore:
+    def __init__(self, sqlite_path="data/conversations.sqlite"):
+        self.sqlite_path = sqlite_path
+        os.makedirs(os.path.dirname(sqlite_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(sqlite_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS messages "
+            "(id INTEGER PRIMARY KEY, session_id TEXT, seq INTEGER, created_at REAL, role TEXT, content TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_session_seq ON messages (session_id, seq)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_created_at ON messages (created_at)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (session_id TEXT PRIMARY KEY, content TEXT, covers_seq INTEGER, updated_at REAL)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS session_claims (session_id TEXT PRIMARY KEY, owner TEXT, heartbeat REAL)")
+        self.db.commit()
+        self.owner = uuid.uuid4().hex
+        self.claimed = None
+        self.lock = threading.Lock()
+        self.writes = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_settings(cls, settings):
+        if not settings.enabled:
+            return None
+        return cls(settings.sqlite_path)
+
+    def session(self, settings):
+        # The configured session, or the most recent one unless another running process has it, or a new one
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                session_id = settings.session_id
+                if not session_id and settings.resume_last_session:
+                    row = self.db.execute("SELECT session_id FROM messages ORDER BY created_at DESC LIMIT 1").fetchone()
+                    if row is not None:
+                        claim = self.db.execute(
+                            "SELECT 1 FROM session_claims WHERE session_id = ? AND owner != ? AND heartbeat > ?",
+                            (row[0], self.owner, time.time() - CLAIM_TIMEOUT),
+                        ).fetchone()
+                        if claim is None:
+                            session_id = row[0]
+                        else:
+                            print("The last conversation is open in another process, starting a new one")
+                session_id = session_id or uuid.uuid4().hex
+                self.db.execute("INSERT OR REPLACE INTO session_claims (session_id, owner, heartbeat) VALUES (?, ?, ?)", (session_id, self.owner, time.time()))
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+            self.claimed = session_id
+        return session_id
+
+    def append(self, session_id, seq, role, content):
+        self.writes.put(("message", (session_id, seq, time.time(), role, content)))
+
+    def put_summary(self, session_id, content, covers_seq):
+        self.writes.put(("summary", (session_id, content, covers_seq, time.time())))
+
+    def load(self, session_id, limit):
+        # Latest summary, the messages after it (newest limit of them at most, oldest first, starting on a question)
+        # and the next free sequence number
+        with self.lock:
+            row = self.db.execute("SELECT content, covers_seq FROM summaries WHERE session_id = ?", (session_id,)).fetchone()
+            summary, covers_seq = row if row is not None else ("", -1)
+            rows = self.db.execute(
+                "SELECT seq, role, content FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq DESC LIMIT ?",
+                (session_id, covers_seq, limit),
+            ).fetchall()
+            last_seq = self.db.execute("SELECT MAX(seq) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+        next_seq = max(last_seq if last_seq is not None else -1, covers_seq) + 1
+        rows = rows[::-1]
+        # The limit can cut a turn in half, a tail that opens with an answer whose question was dropped starts at the
+        # next question instead
+        while rows and rows[0][1] != "human":
+            rows.pop(0)
+        return summary, covers_seq, rows, next_seq
+
+    def _write_loop(self):
+        while True:
+            try:
+                batch = [self.writes.get(timeout=HEARTBEAT_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            # Take whatever else queued up while waiting, one commit covers all of it
+            while True:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is None for item in batch)
+            messages = [item[1] for item in batch if item is not None and item[0] == "message"]
+            summaries = [item[1] for item in batch if item is not None and item[0] == "summary"]
+            with self.lock:
+                if messages:
+                    self.db.executemany("INSERT INTO messages (session_id, seq, created_at, role, content) VALUES (?, ?, ?, ?, ?)", messages)
+                if summaries:
+                    self.db.executemany("INSERT OR REPLACE INTO summaries (session_id, content, covers_seq, updated_at) VALUES (?, ?, ?, ?)", summaries)
+                if self.claimed is not None:
+                    self.db.execute("UPDATE session_claims SET heartbeat = ? WHERE session_id = ? AND owner = ?", (time.time(), self.claimed, self.owner))
+                self.db.commit()
+            for _ in batch:
+                self.writes.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        self.writes.join()
+
+    def close(self):
+        # Everything queued is written before the claim on the session is given up
+        if self.writer.is_alive():
+            self.writes.put(None)
+            self.writer.join()
+        if self.claimed is not None:
+            with self.lock:
+                self.db.execute("DELETE FROM session_claims WHERE session_id = ? AND owner = ?", (self.claimed, self.owner))
+                self.db.commit()
+            self.claimed = None
@@ -0,0 +1,111 @@
+# Persistent cache in front of an embeddings model
+# Vectors are stored as float32 blobs in SQLite, keyed by the model name and a hash of the normalized text, and the
+# least recently used entries are evicted once the cache grows past max_entries. Document batches are looked up first
+# and only the misses are sent to the API in one call
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import configparser
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+class EmbeddingCacheSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.enabled = config.getboolean("embedding_cache", "enabled", fallback=True)
+        self.sqlite_path = config.get("embedding_cache", "sqlite_path", fallback="cache/embeddings.sqlite")
+        self.max_entries = config.getint("embedding_cache", "max_entries", fallback=50000)
+
+def normalize_query(text):
+    # Questions that only differ in case, spacing or the closing question mark share an embedding
+    return " ".join(text.lower().split()).rstrip(" ?.!")
+
+def normalize_document(text):
+    return " ".join(text.split())
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, sqlite_path="cache/embeddings.sqlite", max_entries=50000, model=None):
+        self.embeddings = embeddings
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(sqlite_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(sqlite_path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, last_used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.db.commit()
+
+    @classmethod
+    def from_settings(cls, embeddings, settings):
+        if not settings.enabled:
+            return embeddings
+        return cls(embeddings, settings.sqlite_path, settings.max_entries)
+
+    def key(self, normalized_text):
+        return f"{self.model}:{hashlib.sha1(normalized_text.encode('utf-8')).hexdigest()}"
+
+    def _lookup(self, keys):
+        found = {}
+        now = time.time()
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32).tolist()) for key, vector in rows)
+            if found:
+                self.db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self.db.commit()
+        return found
+
+    def _store(self, items):
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items],
+            )
+            count = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                self.db.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self.db.commit()
+
+    def embed_query(self, text):
+        key = self.key(normalize_query(text))
+        cached = self._lookup([key])
+        if key in cached:
+            self.hits += 1
+            return cached[key]
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._store([(key, vector)])
+        return vector
+
+    def embed_documents(self, texts):
+        keys = [self.key(normalize_document(text)) for text in texts]
+        cached = self._lookup(list(set(keys)))
+
+        # Send each distinct missing text to the API once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
@@ -0,0 +1,175 @@
+# Local intent router in front of the agent
+# Short conversational turns like "hello", "thanks" or "that's all" get a canned reply and plain math goes straight to
+# the local calculator, only open-ended requests reach the agent and its tool-heavy prompt. Keyword rules are tried
+# first, short turns they miss are matched against the centroid of a few example phrases per intent by embedding
+
+import re
+import random
+import threading
+import configparser
+
+import numpy as np
+
+from calculator import CalculatorError, is_calculation
+from telemetry import Telemetry
+
+class IntentRouterSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.enabled = config.getboolean("intent_router", "enabled", fallback=True)
+        self.use_embeddings = config.getboolean("intent_router", "use_embeddings", fallback=True)
+        # Cosine similarity to an intent centroid needed to skip the agent, ada-002 puts unrelated text around 0.7-0.8
+        self.threshold = config.getfloat("intent_router", "threshold", fallback=0.9)
+        # Longer turns are never matched by embedding, they almost always carry a real request
+        self.max_words = config.getint("intent_router", "max_words", fallback=6)
+        self.direct_tools = config.getboolean("intent_router", "direct_tools", fallback=True)
+
+class Route:
+    def __init__(self, intent, response=None, tool=None, end_conversation=False):
+        self.intent = intent
+        self.response = response
+        self.tool = tool
+        self.end_conversation = end_conversation
+
+    @property
+    def handled(self):
+        return self.response is not None
+
+AGENT = Route("agent")
+
+class Intent:
+    def __init__(self, name, pattern, examples, responses, end_conversation=False):
+        self.name = name
+        self.pattern = re.compile(rf"^(?:{pattern})$")
+        self.examples = examples
+        self.responses = responses
+        self.end_conversation = end_conversation
+
+# The rules only match the whole turn, "thanks, and what's the weather" still goes to the agent
+INTENTS = [
+    Intent(
+        "greeting",
+        r"(hi|hello|hey|hiya|yo|good (morning|afternoon|evening)|greetings)( there)?",
+        ["hello", "hi there", "hey", "good morning", "good evening", "hey how are you"],
+        ["Hello. What can I do for you?", "Good to hear from you. How can I help?"],
+    ),
+    Intent(
+        "thanks",
+        r"(thanks|thank you|thank you very much|thanks (so|very) much|thanks a lot|cheers|much appreciated)"
+        r"( (again|for (that|your help|the help)))?( that('s| is| was) (great|helpful|perfect|all))?",
+        ["thank you", "thanks a lot", "thanks that was helpful", "much appreciated", "cheers", "thank you so much for your help"],
+        ["You're welcome.", "My pleasure."],
+        end_conversation=True,
+    ),
+    Intent(
+        "closing",
+        r"(that('s| is| will be) (all|it)|(no )?(that's|thats) (all|it)( for now)?|nothing else|no thanks|no thank you|"
+        r"never ?mind|(good)?bye|goodbye|good night|see you( later)?|i'm done|we're done|stop|cancel)( for now)?",
+        ["that's all", "that will be all", "nothing else", "goodbye", "bye for now", "no that's it", "i'm done", "never mind"],
+        ["Very well. Call me if you need anything.", "Goodbye for now."],
+        end_conversation=True,
+    ),
+    Intent(
+        "acknowledgement",
+        r"(ok|okay|alright|all right|got it|cool|great|perfect|sounds good|good|nice|i see|understood)",
+        ["okay", "got it", "alright", "sounds good", "cool", "great", "i see"],
+        ["Very good.", "Alright."],
+    ),
+]
+
+FILLER = re.compile(r"[^\w\s']")
+
+class IntentRouter:
+    def __init__(self, embeddings=None, bot_name="", threshold=0.9, max_words=6, calculator=None, telemetry=None):
+        self.embeddings = embeddings
+        self.telemetry = telemetry or Telemetry()
+        self.threshold = threshold
+        self.max_words = max_words
+        self.calculator = calculator
+        self.intents = INTENTS
+        self.bot_name = re.compile(rf"\b{re.escape(bot_name.lower())}\b") if bot_name else None
+        self.centroids = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, embeddings, bot_name, settings, calculator=None, telemetry=None):
+        if not settings.enabled:
+            return None
+        return cls(
+            embeddings if settings.use_embeddings else None,
+            bot_name,
+            settings.threshold,
+            settings.max_words,
+            calculator if settings.direct_tools else None,
+            telemetry,
+        )
+
+    def responses(self):
+        # Every canned reply, so the speech cache can render them ahead of time
+        return [response for intent in self.intents for response in intent.responses]
+
+    def normalize(self, text):
+        text = FILLER.sub(" ", text.lower())
+        if self.bot_name is not None:
+            text = self.bot_name.sub(" ", text)
+        return " ".join(text.split())
+
+    def route(self, text):
+        normalized = self.normalize(text)
+        if not normalized:
+            return AGENT
+        for intent in self.intents:
+            if intent.pattern.match(normalized):
+                return self.reply(intent)
+        route = self.direct(text)
+        if route is not None:
+            return route
+        if self.embeddings is not None and len(normalized.split()) <= self.max_words:
+            try:
+                intent = self.nearest(normalized)
+            except Exception as e:
+                # The agent can still answer the turn, a failed embeddings call shouldn't fail it
+                print(f"Intent router embedding failed, passing the turn to the agent: {e}")
+                self.telemetry.count("router.embedding_errors")
+                intent = None
+            if intent is not None:
+                return self.reply(intent)
+        return AGENT
+
+    def reply(self, intent):
+        return Route(intent.name, random.choice(intent.responses), end_conversation=intent.end_conversation)
+
+    def direct(self, text):
+        # Single-tool turns that can be answered without the agent, for now plain math and unit conversions
+        if self.calculator is None or not any(c.isdigit() for c in text) or not is_calculation(text):
+            return None
+        try:
+            answer = self.calculator.calculate(text)
+        except CalculatorError:
+            return None
+        return Route("tool", answer.replace("Answer: ", "That's ", 1) + ".", tool="Calculator")
+
+    def nearest(self, normalized):
+        centroids = self.load_centroids()
+        vector = np.asarray(self.embeddings.embed_query(normalized), dtype=np.float32)
+        vector /= max(np.linalg.norm(vector), 1e-12)
+        scores = centroids @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return self.intents[best]
+
+    def load_centroids(self):
+        # Embedded on first use rather than at startup, the embedding cache keeps them across restarts
+        with self.lock:
+            if self.centroids is None:
+                centroids = []
+                for intent in self.intents:
+                    vectors = np.asarray(self.embeddings.embed_documents(intent.examples), dtype=np.float32)
+                    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                    centroid = vectors.mean(axis=0)
+                    centroids.append(centroid / max(np.linalg.norm(centroid), 1e-12))
+                self.centroids = np.stack(centroids)
+            return self.centroids
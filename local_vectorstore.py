@@ -0,0 +1,146 @@
+# Local vector store that can stand in for Pinecone
+# Embeddings are kept unit-normalized in a flat float32 file that is memory-mapped for search, so cosine similarity is
+# a single matrix product. Texts and metadata sit next to it in a JSON lines sidecar, and new texts are appended in place
+
+import os
+import json
+import uuid
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.vectorstores.base import VectorStore
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, path, embedding, block_size=65536):
+        self.path = path
+        self.embedding = embedding
+        self.block_size = block_size
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.metadata_path = os.path.join(path, "metadata.jsonl")
+        self.index_path = os.path.join(path, "index.json")
+        os.makedirs(path, exist_ok=True)
+
+        self.dim = None
+        self.count = 0
+        self.metadata_bytes = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.dim = index["dim"]
+            self.count = index["count"]
+            self.metadata_bytes = index["metadata_bytes"]
+
+        # Only rows recorded in index.json count, anything past that is a half finished append
+        self.records = []
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path, encoding="utf-8", newline="\n") as f:
+                for line in f:
+                    if len(self.records) == self.count:
+                        break
+                    self.records.append(json.loads(line))
+        self.matrix = None
+
+    def _load_matrix(self):
+        if self.matrix is None and self.count:
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+        return self.matrix
+
+    def _truncate(self, path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    def add_embeddings(self, texts, vectors, metadatas=None):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError("Expected one embedding per text")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding size {vectors.shape[1]} does not match the index size {self.dim}")
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+        # Release the map before touching the file, then drop leftovers of an interrupted append
+        self.matrix = None
+        self._truncate(self.vectors_path, self.count * self.dim * 4)
+        self._truncate(self.metadata_path, self.metadata_bytes)
+
+        ids = [str(uuid.uuid4()) for _ in texts]
+        records = [{"id": id, "text": text, "metadata": (metadatas[i] if metadatas else {}) or {}} for i, (id, text) in enumerate(zip(ids, texts))]
+        lines = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.metadata_path, "ab") as f:
+            f.write(lines)
+
+        # index.json is the commit point for the append
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"dim": self.dim, "count": self.count + len(records), "metadata_bytes": self.metadata_bytes + len(lines)}, f)
+        os.replace(temp_path, self.index_path)
+
+        self.records.extend(records)
+        self.count += len(records)
+        self.metadata_bytes += len(lines)
+        return ids
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas)
+
+    def search_vectors(self, queries, k=4):
+        # Batched top-k cosine search, returns one list of (row, score) per query
+        matrix = self._load_matrix()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        if matrix is None:
+            return [[] for _ in queries]
+
+        k = min(k, self.count)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        # Scan in blocks so a large index never needs a full (queries x rows) score matrix in memory
+        for start in range(0, self.count, self.block_size):
+            scores = queries @ matrix[start:start + self.block_size].T
+            rows = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [list(zip(rows.tolist(), scores.tolist())) for rows, scores in zip(best_rows, best_scores)]
+
+    def _document(self, row):
+        record = self.records[row]
+        return Document(page_content=record["text"], metadata=dict(record["metadata"]))
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, **kwargs):
+        return [(self._document(row), score) for row, score in self.search_vectors([embedding], k)[0]]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    def _similarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+        # Cosine similarity is in [-1, 1], relevance scores have to be in [0, 1]
+        return [(document, min(max((score + 1) / 2, 0.0), 1.0)) for document, score in self.similarity_search_with_score(query, k)]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, path="data/vector_index", **kwargs):
+        store = cls(path, embedding)
+        store.add_texts(texts, metadatas)
+        return store
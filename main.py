@@ -1,252 +1,86 @@
-import os
 import random
+import threading
 import keyboard
 import asyncio
 import traceback
 import configparser
-from pathlib import Path
-from dotenv import load_dotenv
 
 import pygame.mixer
-import whisper
-import pyttsx3
-import speech_recognition as sr
-from bark import SAMPLE_RATE, generate_audio, preload_models
-from IPython.display import Audio
-import torchaudio
-from scipy.io.wavfile import write as write_wav
 
-import openai
-import pinecone
-from pydantic import BaseSettings
-from langchain.agents import Tool
-from langchain.memory import ConversationTokenBufferMemory, ReadOnlySharedMemory
-from langchain.chat_models import ChatOpenAI
-from langchain.utilities import GoogleSearchAPIWrapper, WikipediaAPIWrapper, WolframAlphaAPIWrapper, OpenWeatherMapAPIWrapper
-from langchain.agents import initialize_agent
-from langchain.chains import LLMMathChain, RetrievalQA
-from langchain.utilities.zapier import ZapierNLAWrapper
-from langchain.agents.agent_toolkits import ZapierToolkit
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import Pinecone
-from langchain.chains.question_answering import load_qa_chain
-from langchain.chains.summarize import load_summarize_chain
+from transcription import TranscriptionService
+from microphone import MicrophoneStream, VoiceActivityDetector, VoiceActivitySettings
+from wake_word import WakeWordDetector
+from speech import SpeechPipeline
+from tts import TTSService
+from audio_output import AudioOutput, AudioOutputSettings, PRIORITY_CHIME
+from speech_cache import SpeechCache, SpeechCacheSettings
 
-# Set audio backend to soundfile
-torchaudio.set_audio_backend("soundfile")
+from agent import config, BOT_NAME, recover_from_overflow, telemetry, intent_router
+from voice_turn import run_turn
 
-# Load settings.ini and get bot name
-config = configparser.ConfigParser()
-config.read("settings.ini")
-bot_name = config.get("settings", "bot_name")
-BOT_NAME = bot_name
-
-class SearchSettings:
-    def __init__(self, file_path="settings.ini"):
-        config = configparser.ConfigParser()
-        config.read(file_path)
-
-        self.enable_search = config.getboolean("tools", "enable_search")
-        self.enable_wikipedia = config.getboolean("tools", "enable_wikipedia")
-        self.enable_calculator = config.getboolean("tools", "enable_calculator")
-        self.enable_wolfram_alpha = config.getboolean("tools", "enable_wolfram_alpha")
-        self.enable_weather = config.getboolean("tools", "enable_weather")
-        self.enable_zapier = config.getboolean("tools", "enable_zapier")
-        self.enable_pinecone = config.getboolean("tools", "enable_pinecone")
-
-# You can change the history_prompt for Bark in the settings GUI or settings.ini, see Bark documentation for more details
-class VoiceSynthesisSettings(BaseSettings):
-    use_bark = config.getboolean("voice", "use_bark")
-    history_prompt = config.get("voice", "history_prompt")
-
-    use_bark: bool = use_bark
-    history_prompt: str = history_prompt
-
-    class Config:
-        env_prefix = "VOICE_SYNTHESIS_"
-
-voice_synthesis_settings = VoiceSynthesisSettings()
+pygame.mixer.init()
 
-# Download and load all Bark models (this will take a few minutes but only needs to be done once)
-if voice_synthesis_settings.use_bark:
-    preload_models()
+# Fixed phrases are rendered once and then served from the speech cache
+GREETINGS = ['Yes?', 'At your service.', 'What can I do for you?']
+ERROR_MESSAGE = "Unfortunately, I have encountered an error. Is there anything else I can help you with?"
+CONTEXT_OVERFLOW_MESSAGE = "Apologies, the last request went over the maximum context length so I had to forget the older part of our conversation. Is there anything else I can help you with?"
 
-# Initialize variables
-env_path = Path(__file__).parent / ".env"
-load_dotenv(dotenv_path=env_path)
-openai.api_key = os.getenv("OPENAI_API_KEY")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-GOOGLE_CSE_ID = os.getenv("GOOGLE_CSE_ID")
-WOLFROM_ALPHA_APPID = os.getenv("WOLFROM_ALPHA_APPID")
-OPENWEATHERMAP_API_KEY = os.getenv("OPENWEATHERMAP_API_KEY")
-ZAPIER_NLA_API_KEY = os.getenv("ZAPIER_NLA_API_KEY")
-PINE_API_KEY = os.getenv("PINE_API_KEY")
-PINE_ENV = os.getenv("PINE_ENV")
+# One microphone stream stays open for the whole session, the wake word detector and prompt capture both read
+# from its ring buffer and share its running noise floor, so there's no calibration pause between them
+voice_activity_settings = VoiceActivitySettings()
+microphone = MicrophoneStream(buffer_seconds=voice_activity_settings.max_utterance + 10)
+wake_word_detector = WakeWordDetector(microphone, BOT_NAME)
+voice_activity = VoiceActivityDetector(microphone, voice_activity_settings)
 
-# Initialize Pinecone
-embeddings = OpenAIEmbeddings()
-pinecone_env = config.get("pinecone", "pinecone_env")
+# Chimes and speech play on the audio output thread, which also watches the microphone for barge-in
+audio_output = AudioOutput.from_settings(microphone, AudioOutputSettings(), telemetry)
+audio_output.preload("intro.wav", "start.mp3", "stop.mp3")
 
-pinecone.init(
-    api_key=PINE_API_KEY,
-    environment=pinecone_env
-)
+speech_cache = SpeechCache.from_settings(SpeechCacheSettings())
+# The voice engine (tts_backend, history_prompt and rate under [voice]) is loaded once on its own worker thread,
+# Bark runs in a separate worker process unless bark_process is off. Changing it in settings.ini takes effect on the next sentence
+tts = TTSService(telemetry=telemetry)
+speech = SpeechPipeline(tts, cache=speech_cache, telemetry=telemetry, output=audio_output)
+# The router's canned replies too, so a "thanks" or "that's all" is answered without any synthesis
+speech.prerender([*GREETINGS, ERROR_MESSAGE, CONTEXT_OVERFLOW_MESSAGE, *(intent_router.responses() if intent_router is not None else [])])
 
-index_name = config.get("pinecone", "pinecone_index")
-docsearch = Pinecone.from_existing_index(index_name, embeddings)
+# Load Whisper once at startup instead of on every prompt
+transcriber = TranscriptionService()
 
-settings = SearchSettings("settings.ini")
-pygame.mixer.init()
-voice_synthesis_settings = VoiceSynthesisSettings()
-recognizer = sr.Recognizer()
+chat_thread = None
 
 def start_chat():
-    chat_script_path = Path(__file__).parent / "chat.py"
-    os.system(f"python {chat_script_path}")
-
-def listen_for_wake_word(wake_word):
-    with sr.Microphone() as source:
-        recognizer.adjust_for_ambient_noise(source)
-        while True:
-            audio = recognizer.listen(source, phrase_time_limit=2)
-            try:
-                transcription = recognizer.recognize_google(audio)
-                print(f"Heard: {transcription}")
-                if wake_word.lower() in transcription.lower():
-                    return
-            except sr.UnknownValueError:
-                pass
-            except sr.RequestError as e:
-                print("Could not request results; {0}".format(e))
+    # The chat window runs on its own thread in this process and talks to the same agent as the voice loop
+    # tkinter and the theme are only imported the first time it's opened
+    global chat_thread
+    if chat_thread is not None and chat_thread.is_alive():
+        return
+    import chat
+    chat_thread = threading.Thread(target=chat.main, daemon=True)
+    chat_thread.start()
+
+def listen_for_wake_word():
+    # Returns the WakeWord with the segment the wake word was heard in
+    with telemetry.span("voice.wake_word"):
+        return wake_word_detector.wait()
+
+def listen_for_prompt(start=None, start_timeout=None):
+    with telemetry.span("voice.capture", follow_on=start is not None) as span:
+        audio = voice_activity.listen(start, start_timeout)
+        span["audio_seconds"] = 0 if audio is None else round(len(audio) / microphone.sample_rate, 2)
+    if audio is None:
+        return None
+    with telemetry.span("voice.transcribe"):
+        return transcriber.transcribe(audio)
 
 
 def synthesize_speech_v2(text):
-    if voice_synthesis_settings.use_bark:
-        history_prompt = voice_synthesis_settings.history_prompt
-        audio_array = generate_audio(text, history_prompt=history_prompt)
-        Audio(audio_array[0], rate=SAMPLE_RATE)
-        with open("audio_temp.wav", "wb") as f:
-            write_wav(f, SAMPLE_RATE, audio_array[0])
-        play_mp3("audio_temp.wav")
-    else:
-        engine = pyttsx3.init()
-        engine.setProperty('rate', 150)
-        engine.say(text)
-        engine.runAndWait()
-
-def play_mp3(file_path):
-    pygame.mixer.music.load(file_path)
-    pygame.mixer.music.play()
-    while pygame.mixer.music.get_busy():
-        pygame.time.Clock().tick(10)
-
-# Define the memory and the LLM engine
-llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0.5, max_tokens=150, verbose=True)
-memory = ConversationTokenBufferMemory(llm=llm, max_token_limit=1000, memory_key="chat_history", return_messages=True)
-doc_chain = load_qa_chain(llm, chain_type="map_reduce")
-readonlymemory = ReadOnlySharedMemory(memory=memory)
-
-# Tool definitions and wikipedia hack
-search = GoogleSearchAPIWrapper(k=2)
-wikipedia = WikipediaAPIWrapper()
-llm_math = LLMMathChain(llm=llm)
-wolfram_alpha = WolframAlphaAPIWrapper()
-weather = OpenWeatherMapAPIWrapper()
-zapier= ZapierNLAWrapper()
-toolkit = ZapierToolkit.from_zapier_nla_wrapper(zapier)
-retriever = docsearch.as_retriever(search_type="similarity", search_kwargs={"k":2})
-pinecone_tool = RetrievalQA.from_chain_type(llm=llm, chain_type="map_rerank", retriever=docsearch.as_retriever())
-wikisummarize = load_summarize_chain(llm, chain_type="stuff")
-
-class WikiPage:
-    def __init__(self, title, summary):
-        self.title = title
-        self.page_content = summary
-        self.metadata = {}
-
-def wiki_summary(search_query: str) -> str:
-    wikipedia_wrapper = wikipedia
-    wiki_result = wikipedia_wrapper.run(search_query)
-
-    if not wiki_result:
-        return "No good Wikipedia Search Result was found"
+    with telemetry.span("speech.say"):
+        speech.say(text)
 
-    wiki_pages = []
-    for section in wiki_result.split("\n\n"):
-        title, summary = section.split("\nSummary: ", 1)
-        title = title.replace("Page: ", "")
-        wiki_pages.append(WikiPage(title=title, summary=summary))
-
-    summary_result = wikisummarize.run(wiki_pages)
-    return summary_result
-
-tools = []
-
-if settings.enable_search:
-    tools.append(
-        Tool(
-            name="Search",
-            func=search.run,
-            description="Useful when you need to answer questions about current events and real-time information"
-        )
-    )
-if settings.enable_wikipedia:
-    tools.append(
-        Tool(
-            name="Wikipedia",
-            func=wikipedia.run,
-            description="Useful for searching information on historical information on Wikipedia. "
-            "Use this more than the normal search if the question is about events that occured before 2023, like the 'What was the 2008 financial crisis?' or 'Who won the 2016 US presidential election?'"
-        )
-    )
-if settings.enable_calculator:
-    tools.append(
-        Tool(
-            name='Calculator',
-            func=llm_math.run,
-            description='Useful for when you need to answer questions about math.'
-        )
-    )
-if settings.enable_wolfram_alpha:
-    tools.append(
-        Tool(
-            name='Wolfram Alpha',
-            func=wolfram_alpha.run,
-            description="Useful for when you need to answer questions about Math, "
-                        "Science, Technology, Culture, people, Society and Everyday Life. "
-                        "Input should be a search query"
-        )
-    )
-if settings.enable_weather:
-    tools.append(
-        Tool(
-            name='Weather',
-            func=weather.run,
-            description="Useful for when you need to answer questions about weather."
-        )
-    )
-if settings.enable_pinecone:
-    pinecone_name = config.get("pinecone", "tool_name")
-    pinecone_description = config.get("pinecone", "tool_description")
-
-    tools.append(
-        Tool(
-            name=pinecone_name,
-            func=pinecone_tool.run,
-            description=pinecone_description
-        )
-    )
-
-bot_context = config.get("settings", "bot_context")
-CONTEXT = bot_context
-
-# Probably hacky workaround so that the agent chain respects the Zapier settings since it uses a toolkit
-if settings.enable_zapier:
-    agent_chain = initialize_agent([*toolkit.get_tools(), *tools], llm, agent="chat-conversational-react-description", verbose=True, memory=memory)
-else:
-    agent_chain = initialize_agent(tools, llm, agent="chat-conversational-react-description", verbose=True, memory=memory)
-
-agent_chain.memory.chat_memory.add_ai_message(CONTEXT)
+def play_chime(file_path):
+    # Returns right away, wait on the returned clip when the chime must not end up in a recording
+    return audio_output.play(file_path, PRIORITY_CHIME)
 
 async def main():
     config = configparser.ConfigParser()
@@ -255,59 +89,79 @@ async def main():
 
     keyboard.add_hotkey(hotkey, start_chat, suppress=True)
     print(f"Press {hotkey} to launch chat window")
+    microphone.start()
     while True:
         print(f"Waiting for wake word {BOT_NAME} to prompt")
-        play_mp3("intro.wav")
-
-        listen_for_wake_word(BOT_NAME)
-
-        greeting = random.choice(['Yes?', 'At your service.', 'What can I do for you?'])
-        synthesize_speech_v2(greeting)
+        # Waited on so the intro doesn't end up in the wake word detector's buffer
+        play_chime("intro.wav").wait()
+
+        wake = listen_for_wake_word()
+        if wake is None:
+            break
+
+        # Someone who carries straight on after the wake word doesn't have to wait for the greeting. If the question
+        # was part of the wake word segment, the whole utterance is captured again from the start of that segment, so
+        # it isn't cut off at max_window, transcribed with the full model and the wake word stripped. Otherwise the
+        # prompt is picked up from the buffer right where the wake word phrase ended
+        try:
+            if wake.prompt:
+                user_input = wake_word_detector.strip(listen_for_prompt(wake.start) or "") or wake.prompt
+            else:
+                user_input = listen_for_prompt(wake.end, voice_activity_settings.follow_on)
+        except Exception as e:
+            print("Error transcribing audio: {0}".format(e))
+            user_input = None
+        if not user_input:
+            greeting = random.choice(GREETINGS)
+            synthesize_speech_v2(greeting)
+        # Set when the user talked over the assistant, capture then starts where they started talking
+        barge_in = audio_output.take_barge_in()
 
         while True:
-            with sr.Microphone() as source:
-                recognizer.adjust_for_ambient_noise(source)
-                print("Speak a prompt...")
-                play_mp3("start.mp3")
-                audio = recognizer.listen(source)
-
+            if not user_input:
+                if barge_in is None:
+                    print("Speak a prompt...")
+                    play_chime("start.mp3").wait()
                 try:
-                    with open("audio_prompt.wav", "wb") as f:
-                        f.write(audio.get_wav_data())
-                    model = whisper.load_model("base")
-                    result = model.transcribe("audio_prompt.wav")
-                    user_input = result["text"]
-                    print(f"You said: {user_input}")
-                    play_mp3("stop.mp3")
+                    user_input = listen_for_prompt(barge_in)
                 except Exception as e:
                     print("Error transcribing audio: {0}".format(e))
                     continue
-                try:
-                    agent_chain.memory.chat_memory.add_user_message(user_input)
-
-                    input_text = user_input
-                    response = agent_chain.run(input=input_text)
-                    bot_response = response
-
-                    print("Bot's response:", bot_response)
-                    synthesize_speech_v2(bot_response)
+                finally:
+                    barge_in = None
+                if not user_input:
+                    continue
+            print(f"You said: {user_input}")
+            play_chime("stop.mp3")
+            input_text, user_input = user_input, None
 
-                    agent_chain.memory.chat_memory.add_ai_message(bot_response)
+            try:
+                route, bot_response = run_turn(input_text, speech)
+                barge_in = audio_output.take_barge_in()
 
-                    if "you're welcome" in bot_response.lower() or "you are welcome" in bot_response.lower() or "my pleasure" in bot_response.lower():
-                        break
-                except Exception as e:
-                    tb_string = traceback.format_exc()
+                if barge_in is not None:
+                    print("Interrupted, listening...")
+                    continue
 
-                    if "This model's maximum context length is" in tb_string:
-                        agent_chain.memory.chat_memory.clear()
-                        traceback.print_exc()
-                        error_message = "Apologies, the last request went over the maximum context length so I have to clear my memory. Is there anything else I can help you with?"
-                        synthesize_speech_v2(error_message)
-                    else:
-                        traceback.print_exc()
-                        error_message = "Unfortunately, I have encountered an error. Is there anything else I can help you with?"
-                        synthesize_speech_v2(error_message)
+                print("Bot's response:", bot_response)
+
+                # Thanks and closings end the conversation and go back to waiting for the wake word, a thanks the
+                # router didn't catch still does when the agent says you're welcome
+                if route.end_conversation or any(phrase in (bot_response or "").lower() for phrase in ("you're welcome", "you are welcome", "my pleasure")):
+                    break
+            except Exception as e:
+                tb_string = traceback.format_exc()
+
+                if "This model's maximum context length is" in tb_string:
+                    recover_from_overflow()
+                    traceback.print_exc()
+                    synthesize_speech_v2(CONTEXT_OVERFLOW_MESSAGE)
+                else:
+                    traceback.print_exc()
+                    synthesize_speech_v2(ERROR_MESSAGE)
+
+        # Latency percentiles per stage so far, the full spans are in the telemetry log
+        print(telemetry.report())
 
 if __name__ == "__main__":
     asyncio.run(main())
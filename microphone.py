@@ -0,0 +1,155 @@
+# Continuous microphone capture into a ring buffer, so listeners can look at audio that has already been recorded
+# Chunks are addressed by a running index, consumers keep their own cursor and read at their own pace.
+# The capture thread also tracks the background noise floor, so listeners never have to stop and calibrate
+
+import threading
+import configparser
+from collections import deque
+
+import numpy as np
+import speech_recognition as sr
+
+def chunk_rms(chunk):
+    samples = np.frombuffer(chunk, dtype=np.int16).astype(np.float32)
+    if not samples.size:
+        return 0.0
+    return float(np.sqrt(np.mean(samples * samples)))
+
+class VoiceActivitySettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.energy_ratio = config.getfloat("microphone", "energy_ratio", fallback=2.0)
+        self.min_energy = config.getfloat("microphone", "min_energy", fallback=300)
+        # All durations are in seconds
+        self.preroll = config.getfloat("microphone", "preroll", fallback=0.3)
+        self.min_speech = config.getfloat("microphone", "min_speech", fallback=0.1)
+        self.end_silence = config.getfloat("microphone", "end_silence", fallback=0.8)
+        self.max_utterance = config.getfloat("microphone", "max_utterance", fallback=20.0)
+        self.follow_on = config.getfloat("microphone", "follow_on", fallback=0.6)
+
+class MicrophoneStream:
+    def __init__(self, sample_rate=16000, chunk_size=512, buffer_seconds=10):
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.chunk_seconds = chunk_size / sample_rate
+        self.buffer = deque(maxlen=int(buffer_seconds / self.chunk_seconds))
+        self.total_chunks = 0
+        self.noise_floor = None
+        self.condition = threading.Condition()
+        self.microphone = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.microphone = sr.Microphone(sample_rate=self.sample_rate, chunk_size=self.chunk_size)
+        self.microphone.__enter__()
+        self.running = True
+        self.thread = threading.Thread(target=self._capture, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.thread.join()
+        self.microphone.__exit__(None, None, None)
+        self.microphone = None
+        with self.condition:
+            self.buffer.clear()
+            self.condition.notify_all()
+
+    def _capture(self):
+        # The blocking read paces this thread, so it costs next to nothing while idle
+        while self.running:
+            chunk = self.microphone.stream.read(self.chunk_size)
+            self.update_noise_floor(chunk_rms(chunk))
+            with self.condition:
+                self.buffer.append(chunk)
+                self.total_chunks += 1
+                self.condition.notify_all()
+
+    def update_noise_floor(self, energy):
+        # Falls quickly when the room gets quieter and rises slowly, so speech barely moves it
+        # but a fan switching on is picked up within half a minute or so
+        if self.noise_floor is None:
+            self.noise_floor = energy
+        elif energy < self.noise_floor:
+            self.noise_floor += 0.05 * (energy - self.noise_floor)
+        else:
+            self.noise_floor += 0.002 * (energy - self.noise_floor)
+
+    def energy_threshold(self, ratio, min_energy):
+        return max(min_energy, (self.noise_floor or 0.0) * ratio)
+
+    def cursor(self):
+        with self.condition:
+            return self.total_chunks
+
+    def oldest(self):
+        return self.total_chunks - len(self.buffer)
+
+    def read(self, cursor, timeout=None):
+        # Returns (chunk, index), skipping ahead if the cursor has fallen out of the buffer
+        with self.condition:
+            while self.total_chunks <= cursor:
+                if not self.running or not self.condition.wait(timeout):
+                    return None, cursor
+            index = max(cursor, self.oldest())
+            return self.buffer[index - self.oldest()], index
+
+    def get_audio(self, start, end):
+        # Float32 samples for chunks [start, end) that are still in the buffer
+        with self.condition:
+            oldest = self.oldest()
+            chunks = [self.buffer[i - oldest] for i in range(max(start, oldest), min(end, self.total_chunks))]
+        return np.frombuffer(b"".join(chunks), dtype=np.int16).astype(np.float32) / 32768.0
+
+class VoiceActivityDetector:
+    # Cuts utterances out of the ring buffer with an energy VAD against the live noise floor
+    def __init__(self, microphone, settings=None):
+        self.microphone = microphone
+        self.settings = settings or VoiceActivitySettings()
+
+    def chunks(self, seconds):
+        return max(1, int(seconds / self.microphone.chunk_seconds))
+
+    def listen(self, start=None, start_timeout=None):
+        # Float32 samples of the next utterance starting at chunk index start (now by default), or None if nobody
+        # started talking within start_timeout seconds. The preroll before the speech onset is kept
+        settings = self.settings
+        preroll = self.chunks(settings.preroll)
+        min_speech = self.chunks(settings.min_speech)
+        end_silence = self.chunks(settings.end_silence)
+        max_chunks = self.chunks(settings.max_utterance)
+        timeout_chunks = self.chunks(start_timeout) if start_timeout is not None else None
+
+        cursor = self.microphone.cursor() if start is None else max(start, self.microphone.oldest())
+        first = cursor
+        speech_start = None
+        voiced = 0
+        quiet = 0
+        while True:
+            chunk, index = self.microphone.read(cursor, timeout=0.5)
+            if chunk is None:
+                if not self.microphone.running:
+                    return None
+                continue
+            cursor = index + 1
+            loud = chunk_rms(chunk) > self.microphone.energy_threshold(settings.energy_ratio, settings.min_energy)
+
+            if speech_start is None:
+                # A few loud chunks in a row start an utterance, a single click doesn't
+                voiced = voiced + 1 if loud else 0
+                if voiced >= min_speech:
+                    speech_start = index - voiced + 1 - preroll
+                elif timeout_chunks is not None and cursor - first >= timeout_chunks:
+                    return None
+                continue
+
+            quiet = 0 if loud else quiet + 1
+            if quiet >= end_silence or cursor - speech_start >= max_chunks:
+                return self.microphone.get_audio(speech_start, cursor)
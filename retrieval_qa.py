@@ -0,0 +1,93 @@
+# Retrieval QA over the vector store
+# Candidates are reranked locally by their embedding score instead of asking the LLM to score every document, and the
+# default "stuff" mode answers with a single LLM call over as many top documents as fit in the token budget.
+# The map modes are still available, with their per-document calls run concurrently on a small thread pool
+
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.docstore.document import Document
+from langchain.chains.question_answering import load_qa_chain
+
+class RetrievalQASettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.mode = config.get("pinecone", "retrieval_mode", fallback="stuff")
+        self.k = config.getint("pinecone", "retrieval_k", fallback=2)
+        self.fetch_k = config.getint("pinecone", "retrieval_fetch_k", fallback=6)
+        self.max_tokens = config.getint("pinecone", "retrieval_max_tokens", fallback=1500)
+        self.workers = config.getint("pinecone", "retrieval_workers", fallback=4)
+
+class RetrievalQAEngine:
+    def __init__(self, llm, vectorstore, mode="stuff", k=2, fetch_k=6, max_tokens=1500, workers=4):
+        if mode not in ("stuff", "map_rerank", "map_reduce"):
+            raise ValueError(f"Unsupported retrieval mode {mode}, use stuff, map_rerank or map_reduce")
+        self.llm = llm
+        self.vectorstore = vectorstore
+        self.mode = mode
+        self.k = k
+        self.fetch_k = max(fetch_k, k)
+        self.max_tokens = max_tokens
+        self.workers = workers
+        self.chain = load_qa_chain(llm, chain_type=mode)
+
+    @classmethod
+    def from_settings(cls, llm, vectorstore, settings):
+        return cls(llm, vectorstore, settings.mode, settings.k, settings.fetch_k, settings.max_tokens, settings.workers)
+
+    def retrieve(self, query):
+        results = self.vectorstore.similarity_search_with_score(query, k=self.fetch_k)
+        docs = []
+        seen = set()
+        for doc, _ in sorted(results, key=lambda result: -result[1]):
+            if doc.page_content in seen:
+                continue
+            seen.add(doc.page_content)
+            docs.append(doc)
+            if len(docs) == self.k:
+                break
+        return docs
+
+    def fit_to_budget(self, docs):
+        # Keep the best documents that fit, cutting the last one short rather than dropping it
+        fitted = []
+        remaining = self.max_tokens
+        for doc in docs:
+            tokens = self.llm.get_num_tokens(doc.page_content)
+            if tokens <= remaining:
+                fitted.append(doc)
+                remaining -= tokens
+                continue
+            if remaining > 50 or not fitted:
+                cut = int(len(doc.page_content) * remaining / tokens)
+                fitted.append(Document(page_content=doc.page_content[:cut], metadata=doc.metadata))
+            break
+        return fitted
+
+    def map(self, func, docs):
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(docs))) as pool:
+            return list(pool.map(func, docs))
+
+    def run(self, query):
+        docs = self.retrieve(query)
+        if not docs:
+            return "No relevant documents were found"
+
+        if self.mode == "stuff":
+            return self.chain.run(input_documents=self.fit_to_budget(docs), question=query)
+
+        if self.mode == "map_rerank":
+            def answer(doc):
+                try:
+                    result = self.chain.llm_chain.predict_and_parse(context=doc.page_content, question=query)
+                    return int(result[self.chain.rank_key]), result[self.chain.answer_key]
+                except ValueError:
+                    return 0, ""
+            return max(self.map(answer, docs), key=lambda result: result[0])[1]
+
+        def summarize(doc):
+            return Document(page_content=self.chain.llm_chain.predict(context=doc.page_content, question=query))
+        summaries = self.map(summarize, docs)
+        return self.chain.combine_document_chain.run(input_documents=summaries, question=query)
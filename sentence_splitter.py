@@ -0,0 +1,31 @@
+# Splits streamed text into sentences for speech output
+# Kept apart from speech.py so it can be used without loading any TTS backend
+
+import re
+
+SENTENCE_BOUNDARY = re.compile(r"[.!?]+[\"')\]]*\s+|\n+")
+
+class SentenceSplitter:
+    def __init__(self, min_length=20):
+        # Very short fragments ("Hi.", "Mr.") are held back and joined with what follows
+        self.min_length = min_length
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(self.buffer):
+            if match.end() - start < self.min_length:
+                continue
+            sentence = self.buffer[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        rest = self.buffer.strip()
+        self.buffer = ""
+        return [rest] if rest else []
@@ -0,0 +1,191 @@
+# Sentence-pipelined speech output
+# Text is split into sentences as it streams in, a worker renders each sentence through the TTS service while the
+# previous one plays, and the clips are handed to the audio output thread so they play back to back. If the user talks
+# over a response (barge-in) the rest of it is dropped without being rendered
+
+import time
+import queue
+import threading
+import traceback
+from collections import deque
+
+import numpy as np
+
+from audio_io import array_to_sound
+from audio_output import AudioOutput
+from telemetry import Telemetry
+from tts import TTSService
+from sentence_splitter import SentenceSplitter
+
+END_OF_STREAM = None
+WAKE_UP = object()
+
+class SpeechPipeline:
+    def __init__(self, tts=None, cache=None, telemetry=None, output=None):
+        self.telemetry = telemetry or Telemetry()
+        self.tts = tts or TTSService(telemetry=self.telemetry)
+        self.cache = cache
+        self.pending_prerender = deque()
+        # Taken off the queue while batching but not part of the batch, handled next
+        self.held = deque()
+        self.splitter = SentenceSplitter()
+        self.sentences = queue.Queue()
+        self.clips = queue.Queue()
+        self.lock = threading.Lock()
+        self.streamed = False
+        self.interrupted = False
+        # When the first clip of the last response was handed to the output, for end-to-end timings
+        self.first_clip_at = None
+        self.output = output or AudioOutput(telemetry=self.telemetry)
+        self.output.barge_in_listeners.append(self.interrupt)
+
+        threading.Thread(target=self._render, daemon=True).start()
+
+    def feed(self, text):
+        # Called from the LLM callback as tokens arrive
+        with self.lock:
+            self.streamed = True
+            for sentence in self.splitter.feed(text):
+                self.sentences.put(sentence)
+
+    def close(self, full_text=None):
+        # Flush the last partial sentence, or speak full_text if nothing was streamed for this response
+        with self.lock:
+            if not self.streamed and full_text:
+                for sentence in self.splitter.feed(full_text):
+                    self.sentences.put(sentence)
+            for sentence in self.splitter.flush():
+                self.sentences.put(sentence)
+            self.streamed = False
+            self.sentences.put(END_OF_STREAM)
+
+    def prerender(self, phrases):
+        # Rendered by the worker whenever it has nothing live to do, the key is checked again then
+        # in case the backend was switched in the meantime
+        if self.cache is None:
+            return
+        for phrase in phrases:
+            splitter = SentenceSplitter()
+            for sentence in splitter.feed(phrase) + splitter.flush():
+                if self.cache.get(self.tts.cache_key(self.cache, sentence)) is None:
+                    self.pending_prerender.append(sentence)
+        if self.pending_prerender:
+            self.sentences.put(WAKE_UP)
+
+    def _render(self):
+        while True:
+            try:
+                sentence = self._next_sentence(timeout=0.1 if self.pending_prerender else None)
+            except queue.Empty:
+                self._prerender_next()
+                continue
+            if sentence is WAKE_UP:
+                continue
+            if sentence is END_OF_STREAM:
+                self.clips.put(sentence)
+                continue
+            if self.interrupted:
+                continue
+            try:
+                self._render_sentences(sentence)
+            except Exception:
+                traceback.print_exc()
+
+    def _next_sentence(self, timeout=None):
+        if self.held:
+            return self.held.popleft()
+        return self.sentences.get(timeout=timeout)
+
+    def _render_sentences(self, sentence):
+        # A cached sentence is played as is. Otherwise every uncached sentence already waiting goes to the backend
+        # in one utterance if it batches, and its chunks are queued for playback as they stream in
+        worker = self.tts.current()
+        key = None
+        if self.cache is not None:
+            key = self.tts.cache_key(self.cache, sentence, worker.backend)
+            clip = self.cache.get(key)
+            if clip is not None:
+                self.clips.put(array_to_sound(*clip))
+                return
+        sentences = [sentence, *self._waiting(worker.backend)]
+        chunks = []
+        for audio_array, sample_rate in worker.submit(sentences).stream():
+            if self.interrupted:
+                continue
+            chunks.append(audio_array)
+            self.clips.put(array_to_sound(audio_array, sample_rate))
+        # Only single sentences are cached, a batch of them is unlikely to come up again
+        if key is not None and len(sentences) == 1 and chunks and not self.interrupted:
+            self.cache.put(key, np.concatenate(chunks), sample_rate)
+
+    def _waiting(self, backend):
+        # Uncached sentences queued behind the current one, up to a few backend passes worth
+        if backend.batch_chars <= 0:
+            return []
+        budget = backend.batch_chars * 3
+        sentences = []
+        while True:
+            try:
+                sentence = self.sentences.get_nowait()
+            except queue.Empty:
+                return sentences
+            cached = isinstance(sentence, str) and self.cache is not None and self.cache.get(self.tts.cache_key(self.cache, sentence, backend)) is not None
+            if not isinstance(sentence, str) or cached or len(sentence) > budget:
+                self.held.append(sentence)
+                return sentences
+            sentences.append(sentence)
+            budget -= len(sentence)
+
+    def _synthesize(self, sentence):
+        # (samples, sample rate) from the cache, or rendered by the current backend and cached
+        worker = self.tts.current()
+        key = None
+        if self.cache is not None:
+            key = self.tts.cache_key(self.cache, sentence, worker.backend)
+            clip = self.cache.get(key)
+            if clip is not None:
+                return clip
+        audio_array, sample_rate = worker.submit(sentence).result()
+        if key is not None:
+            self.cache.put(key, audio_array, sample_rate)
+        return audio_array, sample_rate
+
+    def _prerender_next(self):
+        sentence = self.pending_prerender.popleft()
+        try:
+            self._synthesize(sentence)
+        except Exception:
+            traceback.print_exc()
+
+    def interrupt(self, index=None):
+        # Called from the barge-in watch, the output has already stopped. Sentences that are still coming are dropped
+        # until the end of the stream
+        self.interrupted = True
+        self.output.stop()
+        self.tts.cancel()
+
+    def play(self):
+        # Runs on the calling thread until the stream is closed and every clip has finished or was cut off
+        start = time.perf_counter()
+        first = True
+        self.first_clip_at = None
+        self.output.listen_while_speaking(True)
+        while True:
+            clip = self.clips.get()
+            if clip is END_OF_STREAM:
+                break
+            if self.interrupted:
+                continue
+            if first:
+                # How long the listener waited for the first audio, LLM and rendering included
+                self.first_clip_at = time.perf_counter()
+                self.telemetry.record("speech.first_clip", self.first_clip_at - start)
+                first = False
+            self.output.play(clip)
+        self.output.wait_until_idle()
+        self.output.listen_while_speaking(False)
+        self.interrupted = False
+
+    def say(self, text):
+        self.close(text)
+        self.play()
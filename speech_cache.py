@@ -0,0 +1,147 @@
+# Content-addressed cache for synthesized speech
+# Clips are keyed by everything that changes how they sound, kept as WAV files on disk with a size cap and
+# least-recently-used eviction, and the most recent ones are also held decoded in memory. The size of the directory
+# is tracked as clips are written, it's only scanned when that goes over the cap and every RESCAN_EVERY writes
+
+import os
+import json
+import wave
+import hashlib
+import threading
+import configparser
+from collections import OrderedDict
+
+import numpy as np
+
+from audio_io import array_to_wav_bytes
+
+# Writes between full scans, which pick up files removed or added behind the cache's back
+RESCAN_EVERY = 100
+EVICT_TO = 0.9
+
+class SpeechCacheSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.enabled = config.getboolean("speech_cache", "enabled", fallback=True)
+        self.directory = config.get("speech_cache", "directory", fallback="cache/speech")
+        self.max_disk_mb = config.getfloat("speech_cache", "max_disk_mb", fallback=200)
+        self.max_memory_items = config.getint("speech_cache", "max_memory_items", fallback=32)
+
+def read_wav(path):
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise wave.Error(f"Unsupported sample width in {path}")
+        channels = wav.getnchannels()
+        sample_rate = wav.getframerate()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, sample_rate
+
+class SpeechCache:
+    def __init__(self, directory="cache/speech", max_disk_mb=200, max_memory_items=32):
+        self.directory = directory
+        self.max_bytes = int(max_disk_mb * 1024 * 1024)
+        self.max_memory_items = max_memory_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        # Bytes on disk as of the last scan plus what was written since, None until the first scan
+        self.disk_bytes = None
+        self.puts_since_scan = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def from_settings(cls, settings):
+        if not settings.enabled:
+            return None
+        return cls(settings.directory, settings.max_disk_mb, settings.max_memory_items)
+
+    def key(self, text, backend, history_prompt="", rate=0):
+        payload = json.dumps([text.strip(), backend, history_prompt, rate])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def get(self, key):
+        with self.lock:
+            clip = self.memory.get(key)
+            if clip is not None:
+                self.memory.move_to_end(key)
+        if clip is not None:
+            # Eviction goes by mtime, so clips served from memory count as used on disk too
+            try:
+                os.utime(self.path(key))
+            except OSError:
+                pass
+            return clip
+
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            clip = read_wav(path)
+        except (OSError, EOFError, wave.Error):
+            # Unreadable or half written, drop it so it gets rendered again
+            self._remove(path)
+            return None
+        os.utime(path)
+        self._remember(key, clip)
+        return clip
+
+    def put(self, key, audio_array, sample_rate):
+        path = self.path(key)
+        temp_path = f"{path}.tmp"
+        data = array_to_wav_bytes(audio_array, sample_rate).getvalue()
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self._remember(key, (np.asarray(audio_array, dtype=np.float32), sample_rate))
+        with self.lock:
+            if self.disk_bytes is not None:
+                self.disk_bytes += len(data) - replaced
+            self.puts_since_scan += 1
+            scan = self.disk_bytes is None or self.disk_bytes > self.max_bytes or self.puts_since_scan >= RESCAN_EVERY
+        if scan:
+            self.evict()
+
+    def _remember(self, key, clip):
+        with self.lock:
+            self.memory[key] = clip
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_items:
+                self.memory.popitem(last=False)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".wav"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        # Once over the cap a tenth of it is freed, so the next writes don't each trigger another scan
+        target = self.max_bytes * EVICT_TO if total > self.max_bytes else self.max_bytes
+        for _, size, path in entries:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+            with self.lock:
+                self.memory.pop(os.path.basename(path)[:-len(".wav")], None)
+        with self.lock:
+            self.disk_bytes = total
+            self.puts_since_scan = 0
@@ -0,0 +1,174 @@
+# Latency telemetry
+# Spans time each stage of a turn. Every span is appended to a rotating JSON lines log and kept in a sliding window
+# per stage for p50/p95/p99, and the totals can be exported in the Prometheus text format to a file or over HTTP
+
+import os
+import json
+import time
+import logging
+import threading
+import configparser
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+class TelemetrySettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.enabled = config.getboolean("telemetry", "enabled", fallback=True)
+        self.log_path = config.get("telemetry", "log_path", fallback="logs/telemetry.jsonl")
+        self.max_bytes = config.getint("telemetry", "max_bytes", fallback=5 * 1024 * 1024)
+        self.backup_count = config.getint("telemetry", "backup_count", fallback=3)
+        self.window = config.getint("telemetry", "window", fallback=1000)
+        # Leave empty or 0 to turn the Prometheus exports off
+        self.prometheus_path = config.get("telemetry", "prometheus_path", fallback="")
+        self.prometheus_port = config.getint("telemetry", "prometheus_port", fallback=0)
+
+def summarize(samples, count):
+    if not samples.size:
+        return None
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "count": count}
+
+class Telemetry:
+    def __init__(self, enabled=False, log_path=None, max_bytes=5 * 1024 * 1024, backup_count=3, window=1000, prometheus_path="", prometheus_port=0):
+        self.enabled = enabled
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+        self.sums = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.prometheus_path = prometheus_path
+        self.prometheus_written = 0.0
+
+        self.logger = None
+        if enabled and log_path:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger = logging.getLogger(f"telemetry.{log_path}")
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+            self.logger.addHandler(handler)
+
+        if enabled and prometheus_port:
+            self.serve(prometheus_port)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.enabled, settings.log_path, settings.max_bytes, settings.backup_count, settings.window, settings.prometheus_path, settings.prometheus_port)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        # Attributes can still be added inside the block, for example token counts or a cache hit
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            if error is not None:
+                attributes["error"] = error
+            self.record(name, time.perf_counter() - start, **attributes)
+
+    def timed(self, name, func, **attributes):
+        def wrapper(*args, **kwargs):
+            with self.span(name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def record(self, name, seconds, **attributes):
+        if not self.enabled:
+            return
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+                self.counts[name] = 0
+                self.sums[name] = 0.0
+            self.samples[name].append(seconds)
+            self.counts[name] += 1
+            self.sums[name] += seconds
+        if self.logger is not None:
+            self.logger.info(json.dumps({"ts": time.time(), "span": name, "ms": round(seconds * 1000, 2), **attributes}, default=str))
+        if self.prometheus_path and time.time() - self.prometheus_written > 5:
+            self.write_prometheus()
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def percentiles(self, name):
+        with self.lock:
+            samples = np.array(self.samples.get(name, ()))
+            count = self.counts.get(name, 0)
+        return summarize(samples, count)
+
+    def snapshot(self):
+        # Copies taken under the lock, so formatting never iterates a dict that a worker thread is adding to
+        with self.lock:
+            samples = {name: np.array(values) for name, values in self.samples.items()}
+            return samples, dict(self.counts), dict(self.sums), dict(self.counters)
+
+    def report(self):
+        samples, counts, _, counters = self.snapshot()
+        lines = []
+        for name in sorted(samples):
+            stats = summarize(samples[name], counts[name])
+            if stats is not None:
+                lines.append(f"{name:<28} n={stats['count']:<6} p50 {stats['p50'] * 1000:9.1f}ms  p95 {stats['p95'] * 1000:9.1f}ms  p99 {stats['p99'] * 1000:9.1f}ms")
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name:<28} {value}")
+        return "\n".join(lines)
+
+    def prometheus_text(self):
+        samples, counts, sums, counters = self.snapshot()
+        lines = ["# TYPE alfred_span_seconds summary"]
+        for name in sorted(samples):
+            stats = summarize(samples[name], counts[name])
+            if stats is None:
+                continue
+            for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+                lines.append(f'alfred_span_seconds{{span="{name}",quantile="{quantile}"}} {stats[key]:.6f}')
+            lines.append(f'alfred_span_seconds_sum{{span="{name}"}} {sums[name]:.6f}')
+            lines.append(f'alfred_span_seconds_count{{span="{name}"}} {counts[name]}')
+        lines.append("# TYPE alfred_events_total counter")
+        for name, value in sorted(counters.items()):
+            lines.append(f'alfred_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        self.prometheus_written = time.time()
+        os.makedirs(os.path.dirname(self.prometheus_path) or ".", exist_ok=True)
+        temp_path = f"{self.prometheus_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, self.prometheus_path)
+
+    def serve(self, port):
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = telemetry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving telemetry metrics on http://127.0.0.1:{port}/metrics")
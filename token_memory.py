@@ -0,0 +1,181 @@
+# Conversation memory with incremental token accounting
+# Each message is tokenized once when it is added and its count is kept next to it, so pruning to the token limit
+# only pops from the left of a deque instead of re-tokenizing the whole history on every turn.
+# Pinned messages (the bot context) are counted against the limit but never evicted, and older turns can be folded
+# into a rolling summary message that sits between them and the recent conversation.
+# With a conversation store attached every message and summary is also persisted, and the tail of the session is
+# loaded the first time the history is used
+
+from collections import deque
+from typing import Any, Dict, List
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.schema import AIMessage, BaseChatMessageHistory, BaseLanguageModel, BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+
+class TokenCountedHistory(BaseChatMessageHistory):
+    def __init__(self, count_tokens, max_token_limit):
+        self.count_tokens = count_tokens
+        self.max_token_limit = max_token_limit
+        self.pinned = []
+        self.pinned_tokens = 0
+        self.summary = None
+        self.summary_text = ""
+        self.summary_tokens = 0
+        self._entries = deque()
+        self.total_tokens = 0
+        self.store = None
+        self.session_id = None
+        self.tail_messages = 0
+        self.next_seq = 0
+        self.loaded = True
+
+    def attach(self, store, session_id, tail_messages):
+        self.store = store
+        self.session_id = session_id
+        self.tail_messages = tail_messages
+        self.loaded = False
+
+    @property
+    def entries(self):
+        # Entries are (message, tokens, seq)
+        self.ensure_loaded()
+        return self._entries
+
+    def ensure_loaded(self):
+        # The stored tail is read on first use instead of at startup
+        if self.loaded:
+            return
+        self.loaded = True
+        summary, _, rows, self.next_seq = self.store.load(self.session_id, self.tail_messages)
+        if summary:
+            self._set_summary(summary)
+        for seq, role, content in rows:
+            message = HumanMessage(content=content) if role == "human" else AIMessage(content=content)
+            self._entries.append((message, self.count_tokens(message), seq))
+            self.total_tokens += self._entries[-1][1]
+        self.prune()
+
+    @property
+    def messages(self):
+        entries = self.entries
+        summary = [self.summary] if self.summary is not None else []
+        return self.pinned + summary + [message for message, _, _ in entries]
+
+    def pin(self, message):
+        self.pinned.append(message)
+        self.pinned_tokens += self.count_tokens(message)
+        # Pinning happens at startup, don't pull in the stored tail just to prune it
+        if self.loaded:
+            self.prune()
+
+    def add_message(self, message):
+        entries = self.entries
+        entries.append((message, self.count_tokens(message), self.next_seq))
+        self.total_tokens += entries[-1][1]
+        if self.store is not None:
+            self.store.append(self.session_id, self.next_seq, message.type, message.content)
+        self.next_seq += 1
+        self.prune()
+
+    def add_user_message(self, message):
+        self.add_message(HumanMessage(content=message))
+
+    def add_ai_message(self, message):
+        self.add_message(AIMessage(content=message))
+
+    def prune(self):
+        self.trim(self.max_token_limit)
+
+    def trim(self, max_tokens):
+        while self.entries and self.token_count() > max_tokens:
+            _, tokens, _ = self.entries.popleft()
+            self.total_tokens -= tokens
+
+    def keep_last(self, count):
+        while len(self.entries) > count:
+            _, tokens, _ = self.entries.popleft()
+            self.total_tokens -= tokens
+
+    def token_count(self):
+        self.ensure_loaded()
+        return self.pinned_tokens + self.summary_tokens + self.total_tokens
+
+    def conversation_tokens(self):
+        self.ensure_loaded()
+        return self.total_tokens
+
+    def oldest(self, max_tokens, keep=2):
+        # The oldest messages adding up to at most max_tokens, never touching the last keep messages
+        selected = []
+        used = 0
+        for message, tokens, _ in list(self.entries)[:max(len(self.entries) - keep, 0)]:
+            if selected and used + tokens > max_tokens:
+                break
+            selected.append(message)
+            used += tokens
+        # Cut after an answer so a question is never separated from it
+        while selected and selected[-1].type == "human":
+            selected.pop()
+        return selected
+
+    def summarize(self, messages, summary):
+        # Replace messages with the summary, skipping any that were pruned while the summary was being written
+        summarized = {id(message) for message in messages}
+        while self.entries and id(self.entries[0][0]) in summarized:
+            _, tokens, _ = self.entries.popleft()
+            self.total_tokens -= tokens
+        # Everything before the oldest message still in memory is covered by the summary now
+        covers_seq = self.entries[0][2] - 1 if self.entries else self.next_seq - 1
+        self._set_summary(summary)
+        if self.store is not None:
+            self.store.put_summary(self.session_id, summary, covers_seq)
+        self.prune()
+
+    def _set_summary(self, summary):
+        self.summary_text = summary
+        self.summary = SystemMessage(content=f"Summary of the earlier conversation: {summary}")
+        self.summary_tokens = self.count_tokens(self.summary)
+
+    def clear(self):
+        # The pinned context survives a clear, only the conversation goes
+        self.entries.clear()
+        self.summary = None
+        self.summary_text = ""
+        self.summary_tokens = 0
+        self.total_tokens = 0
+        if self.store is not None:
+            # An empty summary covering everything so far keeps the cleared messages from being loaded again
+            self.store.put_summary(self.session_id, "", self.next_seq - 1)
+
+class IncrementalTokenMemory(BaseChatMemory):
+    human_prefix: str = "Human"
+    ai_prefix: str = "AI"
+    llm: BaseLanguageModel
+    memory_key: str = "history"
+    max_token_limit: int = 2000
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.chat_memory = TokenCountedHistory(self.count_tokens, self.max_token_limit)
+
+    def count_tokens(self, message):
+        return self.llm.get_num_tokens_from_messages([message])
+
+    def pin(self, content):
+        self.chat_memory.pin(SystemMessage(content=content))
+
+    def attach_store(self, store, session_id, tail_messages=40):
+        self.chat_memory.attach(store, session_id, tail_messages)
+
+    @property
+    def buffer(self) -> List[BaseMessage]:
+        return self.chat_memory.messages
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        if self.return_messages:
+            return {self.memory_key: self.buffer}
+        return {self.memory_key: get_buffer_string(self.buffer, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)}
@@ -0,0 +1,104 @@
+# Result cache for external tools
+# Results are keyed on the tool and the normalized query and expire after a per-tool TTL. Recent results live in an
+# in-memory LRU and an optional SQLite file keeps them across restarts. Only real answers are cached, an empty result,
+# a "nothing found" or an error message is asked again next time. Hits and misses per tool are counted in the
+# telemetry report
+
+import os
+import re
+import time
+import sqlite3
+import threading
+import configparser
+from collections import OrderedDict
+
+from telemetry import Telemetry
+
+class ToolCacheSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.enabled = config.getboolean("tool_cache", "enabled", fallback=True)
+        self.max_entries = config.getint("tool_cache", "max_entries", fallback=256)
+        self.sqlite_path = config.get("tool_cache", "sqlite_path", fallback="cache/tools.sqlite")
+        # TTLs are in seconds
+        self.ttl_search = config.getint("tool_cache", "ttl_search", fallback=600)
+        self.ttl_weather = config.getint("tool_cache", "ttl_weather", fallback=600)
+        self.ttl_wikipedia = config.getint("tool_cache", "ttl_wikipedia", fallback=604800)
+        self.ttl_wolfram_alpha = config.getint("tool_cache", "ttl_wolfram_alpha", fallback=604800)
+
+# What the LangChain wrappers and wiki_tool return instead of raising when they have no answer
+NO_RESULT = re.compile(r"^\s*(no good .*result was found|.*wasn't able to answer|error\b|could not\b|failed\b)", re.IGNORECASE)
+
+def cacheable(result):
+    return isinstance(result, str) and result.strip() != "" and not NO_RESULT.match(result)
+
+def normalize_query(query):
+    return " ".join(query.lower().split()).strip(" ?.!")
+
+class ToolCache:
+    def __init__(self, max_entries=256, sqlite_path=None, telemetry=None):
+        self.max_entries = max_entries
+        self.telemetry = telemetry or Telemetry()
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        if sqlite_path:
+            os.makedirs(os.path.dirname(sqlite_path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS tool_cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+            self.db.execute("DELETE FROM tool_cache WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+
+    @classmethod
+    def from_settings(cls, settings, telemetry=None):
+        if not settings.enabled:
+            return None
+        return cls(settings.max_entries, settings.sqlite_path or None, telemetry)
+
+    def get(self, tool, query):
+        key = f"{tool}:{normalize_query(query)}"
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None and self.db is not None:
+                row = self.db.execute("SELECT expires_at, value FROM tool_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = row
+                    self._remember(key, entry)
+            if entry is not None and entry[0] > now:
+                self.memory.move_to_end(key)
+                result = entry[1]
+            else:
+                result = None
+        self.telemetry.count(f"tool_cache.{tool}.hits" if result is not None else f"tool_cache.{tool}.misses")
+        return result
+
+    def put(self, tool, query, value, ttl):
+        key = f"{tool}:{normalize_query(query)}"
+        entry = (time.time() + ttl, value)
+        with self.lock:
+            self._remember(key, entry)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO tool_cache (key, value, expires_at) VALUES (?, ?, ?)", (key, value, entry[0]))
+                self.db.commit()
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def wrap(self, tool, func, ttl):
+        def cached(query):
+            result = self.get(tool, query)
+            if result is not None:
+                print(f"{tool} cache hit for '{query}'")
+                return result
+            result = func(query)
+            if cacheable(result):
+                self.put(tool, query, result, ttl)
+            return result
+        return cached
+
@@ -0,0 +1,67 @@
+# Compares the per-turn cost of saving to ConversationTokenBufferMemory and to IncrementalTokenMemory as history grows
+# Tokens are counted with tiktoken's cl100k_base when it is available and by splitting on words otherwise, so no API
+# key is needed. Run it from the repo root, for example: python tools/bench_memory.py --turns 400 --limit 4000
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+from langchain.llms.fake import FakeListLLM
+from langchain.memory import ConversationTokenBufferMemory
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from token_memory import IncrementalTokenMemory
+
+try:
+    import tiktoken
+    encoding = tiktoken.get_encoding("cl100k_base")
+    def count(text):
+        return len(encoding.encode(text))
+except Exception:
+    def count(text):
+        return len(text.split())
+
+class CountingLLM(FakeListLLM):
+    def get_num_tokens(self, text):
+        return count(text)
+
+def run(memory, turns, context):
+    # Seed each memory with the bot context the way agent.py used to and does now
+    if isinstance(memory, IncrementalTokenMemory):
+        memory.pin(context)
+    else:
+        memory.chat_memory.add_ai_message(context)
+    timings = []
+    for turn in range(turns):
+        question = f"Question number {turn}, what can you tell me about topic {turn % 17} and how it relates to the last answer?"
+        answer = f"Answer number {turn}. " + "Here is a fairly long explanation of the topic with some detail. " * 4
+        start = time.perf_counter()
+        memory.save_context({"input": question}, {"output": answer})
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+def report(name, timings, windows):
+    size = len(timings) // windows
+    cells = "  ".join(f"{timings[i * size:(i + 1) * size].mean():7.3f}" for i in range(windows))
+    print(f"{name:<30} {cells}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=400)
+    parser.add_argument("--limit", type=int, default=4000)
+    parser.add_argument("--windows", type=int, default=5)
+    args = parser.parse_args()
+
+    context = "You are ALFRED, the extremely advanced AI personal assistant to the user."
+    llm = CountingLLM(responses=[""])
+    baseline = ConversationTokenBufferMemory(llm=llm, max_token_limit=args.limit, memory_key="chat_history", return_messages=True)
+    incremental = IncrementalTokenMemory(llm=llm, max_token_limit=args.limit, memory_key="chat_history", return_messages=True)
+
+    print(f"Mean ms per save_context over {args.windows} windows of {args.turns // args.windows} turns, token limit {args.limit}")
+    report("ConversationTokenBufferMemory", run(baseline, args.turns, context), args.windows)
+    report("IncrementalTokenMemory", run(incremental, args.turns, context), args.windows)
+
+if __name__ == "__main__":
+    main()
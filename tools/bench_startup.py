@@ -0,0 +1,148 @@
+# Startup benchmark and import-time profile
+# Each target is imported in a fresh interpreter a few times and the wall time is reported, importing main is all the
+# work main.py does before "Waiting for wake word" and importing chat is what the chat window does before it opens.
+# With --profile one more run uses python -X importtime and the slowest modules and packages are listed by their
+# cumulative import time. Needs the same environment as the app itself (settings.ini, .env, installed packages).
+# Run it from the repo root, for example:
+#   python tools/bench_startup.py --profile
+#   python tools/bench_startup.py --repeat 5 --output cache/bench/startup.json
+#   python tools/bench_startup.py --repeat 5 --compare cache/bench/startup.json
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+
+TARGETS = {
+    "voice": "main",
+    "chat": "chat",
+    "agent": "agent",
+}
+
+PROBE = "import time; start = time.perf_counter(); import {module}; print('IMPORTED', time.perf_counter() - start, flush=True); import os; os._exit(0)"
+
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def run_target(module, importtime=False):
+    # Returns (wall seconds for the whole interpreter, seconds spent in the import, stderr)
+    # os._exit skips atexit handlers and background threads, so only the startup itself is timed
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", PROBE.format(module=module)]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    match = re.search(r"^IMPORTED ([\d.e-]+)$", result.stdout, re.MULTILINE)
+    if result.returncode != 0 or match is None:
+        tail = "\n".join(line for line in result.stderr.splitlines() if not line.startswith("import time:"))[-2000:]
+        raise RuntimeError(f"Importing {module} failed with exit code {result.returncode}:\n{tail}")
+    return wall, float(match.group(1)), result.stderr
+
+def parse_importtime(stderr):
+    # One row per module: (name, self ms, cumulative ms, depth), depth comes from the indentation of the name
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us) / 1000, int(cumulative_us) / 1000, (len(indent) - 1) // 2))
+    return rows
+
+def profile_report(rows, top):
+    lines = [f"{'module':<48} {'self ms':>9} {'cumulative ms':>14}"]
+    for name, self_ms, cumulative_ms, _ in sorted(rows, key=lambda row: row[2], reverse=True)[:top]:
+        lines.append(f"{name:<48} {self_ms:9.1f} {cumulative_ms:14.1f}")
+
+    # Self time summed per top-level package, so a package that's slow because of many small modules shows up too
+    packages = {}
+    for name, self_ms, _, _ in rows:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + self_ms
+    lines.append("")
+    lines.append(f"{'package':<48} {'total self ms':>14}")
+    for package, total in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append(f"{package:<48} {total:14.1f}")
+    return "\n".join(lines)
+
+def run(args):
+    results = {"targets": {}, "settings": vars(args)}
+    for target in args.targets:
+        module = TARGETS.get(target, target)
+        walls = []
+        imports = []
+        for repeat in range(args.repeat):
+            wall, imported, _ = run_target(module)
+            walls.append(wall)
+            imports.append(imported)
+            print(f"[{repeat + 1}/{args.repeat}] {target}: {wall * 1000:.0f}ms ({imported * 1000:.0f}ms importing {module})")
+        results["targets"][target] = {
+            "module": module,
+            "wall_p50": float(np.percentile(walls, 50)),
+            "wall_min": min(walls),
+            "import_p50": float(np.percentile(imports, 50)),
+        }
+        if args.profile:
+            _, _, stderr = run_target(module, importtime=True)
+            rows = parse_importtime(stderr)
+            print(f"\nImport profile for {module}, {len(rows)} modules")
+            print(profile_report(rows, args.top))
+            results["targets"][target]["profile"] = [
+                {"module": name, "self_ms": self_ms, "cumulative_ms": cumulative_ms, "depth": depth}
+                for name, self_ms, cumulative_ms, depth in rows
+            ]
+    return results
+
+def print_results(results):
+    print(f"\n{'target':<12} {'wall p50':>10} {'wall min':>10} {'import p50':>11}")
+    for target, stats in results["targets"].items():
+        print(f"{target:<12} {stats['wall_p50'] * 1000:8.0f}ms {stats['wall_min'] * 1000:8.0f}ms {stats['import_p50'] * 1000:9.0f}ms")
+
+def compare(base, current, threshold):
+    # Flags any target whose startup got slower by more than threshold percent
+    print(f"\n{'metric':<32} {'base':>10} {'current':>10} {'change':>8}")
+    regressions = 0
+    for target, stats in current["targets"].items():
+        if target not in base["targets"]:
+            continue
+        for key in ("wall_p50", "import_p50"):
+            before = base["targets"][target][key] * 1000
+            after = stats[key] * 1000
+            change = (after - before) / before * 100 if before else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{target + ' ' + key + ' ms':<32} {before:10.1f} {after:10.1f} {change:7.1f}%{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("targets", nargs="*", default=["voice", "chat"], help="voice, chat, agent or any module name")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--profile", action="store_true", help="Also list the slowest imports from python -X importtime")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--compare", help="Compare against a previous --output file")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), results, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
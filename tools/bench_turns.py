@@ -0,0 +1,378 @@
+# Offline end-to-end benchmark of a voice turn
+# Audio fixtures are replayed through the same ring buffer and VAD that main.py listens with, and each prompt goes
+# through the same run_turn as main.py: the router, run_agent with its caches and compaction, and the speech pipeline
+# with the null voice. Only the edges are swapped out, the chat model is scripted, embeddings are hashed locally and the
+# tools are fakes with injected latency, so no microphone, API key or network is needed. Everything the app writes goes
+# to a scratch copy of settings.ini. Reports per-stage and end-to-end percentiles, startup time and peak RSS, and can
+# compare runs.
+# Run it from the repo root, for example:
+#   python tools/bench_turns.py --repeat 3 --output cache/bench/base.json
+#   python tools/bench_turns.py --repeat 3 --compare cache/bench/base.json
+# A scenario is a JSON list of turns: {"text": ..., "audio": "optional.wav", "tool": "optional tool name", "answer": ...}
+
+import time
+STARTED = time.perf_counter()
+
+import os
+import re
+import sys
+import json
+import atexit
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import configparser
+from pathlib import Path
+
+import numpy as np
+import langchain.chat_models
+import langchain.embeddings.openai
+from langchain.agents import Tool
+from langchain.embeddings.base import Embeddings
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import AIMessage, ChatGeneration, ChatResult
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from microphone import MicrophoneStream, VoiceActivityDetector, VoiceActivitySettings, chunk_rms
+from speech_cache import read_wav
+
+SAMPLE_RATE = 16000
+
+DEFAULT_SCENARIO = [
+    {"text": "What's the weather like in London today?", "tool": "Weather",
+     "answer": "It is fourteen degrees and cloudy in London right now. Expect light rain later in the afternoon."},
+    {"text": "Who won the 2016 US presidential election?", "tool": "Wikipedia",
+     "answer": "Donald Trump won the 2016 election against Hillary Clinton. He took office in January 2017."},
+    {"text": "What is twelve times seven?", "tool": "Calculator",
+     "answer": "Twelve times seven is eighty four."},
+    {"text": "Tell me something interesting.",
+     "answer": "Octopuses have three hearts and blue blood. Two of the hearts stop beating while they swim."},
+]
+
+def count_tokens(text):
+    return len(text.split())
+
+def agent_json(action, action_input):
+    return "```json\n" + json.dumps({"action": action, "action_input": action_input}) + "\n```"
+
+class ScriptedChatModel(BaseChatModel):
+    # Deterministic stand-in for ChatOpenAI, answers from a script and streams at a fixed rate. agent.py builds it with
+    # ChatOpenAI's arguments, the ones it reads back are declared here
+    model_name: str = "scripted"
+    temperature: float = 0.0
+    max_tokens: int = 256
+    streaming: bool = False
+    responses: list = []
+    first_token_ms: float = 400
+    tokens_per_second: float = 60
+
+    def get_num_tokens(self, text):
+        return count_tokens(text)
+
+    def get_num_tokens_from_messages(self, messages):
+        return sum(count_tokens(message.content) + 4 for message in messages)
+
+    def _generate(self, messages, stop=None):
+        text = self.responses.pop(0) if self.responses else agent_json("Final Answer", "I'm not sure.")
+        time.sleep(self.first_token_ms / 1000)
+        if self.streaming:
+            for i in range(0, len(text), 4):
+                self.callback_manager.on_llm_new_token(text[i:i + 4], verbose=self.verbose)
+                time.sleep(1 / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None):
+        return self._generate(messages, stop)
+
+def fake_tool(name, latency_ms):
+    def run(query):
+        time.sleep(latency_ms / 1000)
+        return f"{name} result for {query}"
+    return run
+
+class HashEmbeddings(Embeddings):
+    # Stand-in for OpenAIEmbeddings, a bag of hashed words that's stable across runs, so the router and the answer
+    # cache have something to compare
+    model = "bench-hash"
+    size = 256
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"[a-z']+", text.lower()):
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.size] += 1
+        return vector.tolist()
+
+def prepare_workdir():
+    # A scratch copy of settings.ini with every file the app writes pointed inside it, the real tools off, the null
+    # voice and a fresh conversation. The settings classes read settings.ini from the working directory
+    workdir = Path(tempfile.mkdtemp(prefix="bench_turns_"))
+    # Registered before anything opens a file in there, so it runs after their own exit handlers
+    atexit.register(shutil.rmtree, workdir, True)
+    config = configparser.ConfigParser()
+    config.read(ROOT / "settings.ini")
+    if config.has_section("tools"):
+        for key in config["tools"]:
+            config["tools"][key] = "False"
+    config.read_dict({
+        "voice": {"tts_backend": "null"},
+        "speech_cache": {"directory": str(workdir / "speech")},
+        "tool_cache": {"sqlite_path": str(workdir / "tools.sqlite")},
+        "embedding_cache": {"sqlite_path": str(workdir / "embeddings.sqlite")},
+        "conversation_store": {"sqlite_path": str(workdir / "conversations.sqlite"), "session_id": "", "resume_last_session": "False"},
+        "telemetry": {"enabled": "True", "log_path": str(workdir / "telemetry.jsonl"), "prometheus_path": "", "prometheus_port": "0"},
+        "audio_output": {"barge_in": "False"},
+    })
+    with open(workdir / "settings.ini", "w") as file:
+        config.write(file)
+    os.chdir(workdir)
+    return workdir
+
+class ReplayMicrophone(MicrophoneStream):
+    # Feeds the ring buffer from queued audio at real time (scaled by speed) instead of sr.Microphone,
+    # with a little noise in between so the noise floor tracking has something to track
+    def __init__(self, speed=1.0, noise_level=0.003, **kwargs):
+        super().__init__(**kwargs)
+        self.speed = speed
+        self.noise_level = noise_level
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.rng = np.random.default_rng(0)
+        self.loud_threshold = None
+        self.last_loud_at = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._capture, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def play(self, audio):
+        samples = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+        with self.pending_lock:
+            self.pending.extend(samples[i:i + self.chunk_size] for i in range(0, len(samples), self.chunk_size))
+
+    def _capture(self):
+        next_at = time.perf_counter()
+        while self.running:
+            with self.pending_lock:
+                samples = self.pending.pop(0) if self.pending else None
+            if samples is None or len(samples) < self.chunk_size:
+                noise = (self.rng.standard_normal(self.chunk_size) * self.noise_level * 32767).astype(np.int16)
+                if samples is not None:
+                    noise[:len(samples)] = samples
+                samples = noise
+            chunk = samples.tobytes()
+            energy = chunk_rms(chunk)
+            if self.loud_threshold is not None and energy > self.loud_threshold():
+                self.last_loud_at = time.perf_counter()
+            self.update_noise_floor(energy)
+            with self.condition:
+                self.buffer.append(chunk)
+                self.total_chunks += 1
+                self.condition.notify_all()
+            next_at += self.chunk_seconds / self.speed
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+
+def synthetic_utterance(seed, seconds=1.5):
+    # Speech-like bursts of a few harmonics with a syllable-rate envelope, padded with silence
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = rng.uniform(110, 220)
+    voiced = sum(np.sin(2 * np.pi * pitch * harmonic * t) / harmonic for harmonic in range(1, 5))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+    audio = 0.2 * voiced * envelope + 0.01 * rng.standard_normal(t.size)
+    silence = np.zeros(int(0.3 * SAMPLE_RATE))
+    return np.concatenate([silence, audio, silence]).astype(np.float32)
+
+def load_audio(turn, base_dir, seed):
+    if not turn.get("audio"):
+        return synthetic_utterance(seed)
+    samples, sample_rate = read_wav(str(base_dir / turn["audio"]))
+    if sample_rate != SAMPLE_RATE:
+        positions = np.arange(int(len(samples) * SAMPLE_RATE / sample_rate)) * sample_rate / SAMPLE_RATE
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+    return samples
+
+def build_transcriber(args, telemetry):
+    if args.whisper:
+        from transcription import TranscriptionService, TranscriptionSettings
+        settings = TranscriptionSettings()
+        settings.model = args.whisper
+        service = TranscriptionService(settings)
+        service.warm_up()
+        return lambda audio, turn: service.transcribe(audio)
+
+    def transcribe(audio, turn):
+        time.sleep(args.transcribe_ms / 1000)
+        return turn["text"]
+    return transcribe
+
+def peak_rss_mb():
+    # resource is Unix only, on Windows the peak working set comes from psutil if it's installed, otherwise None
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return getattr(psutil.Process().memory_info(), "peak_wset", 0) / (1024 * 1024) or None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def run(args):
+    # The app's modules are imported here rather than at the top, once the scratch settings and the stand-ins are in
+    # place, agent.py builds its LLMs and embeddings when it's imported
+    prepare_workdir()
+    langchain.chat_models.ChatOpenAI = ScriptedChatModel
+    langchain.embeddings.openai.OpenAIEmbeddings = HashEmbeddings
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame.mixer
+    pygame.mixer.init()
+
+    import agent
+    from voice_turn import run_turn
+    from speech import SpeechPipeline
+    from tts import TTSService, NullBackend
+    from audio_output import AudioOutput
+    from speech_cache import SpeechCache, SpeechCacheSettings
+
+    telemetry = agent.telemetry
+    agent.llm.first_token_ms = args.llm_first_token_ms
+    agent.llm.tokens_per_second = args.llm_tokens_per_second
+    agent.agent_chain.verbose = False
+    # The fake tools are wrapped the way agent.py wraps the real ones, tool cache and spans included
+    ttls = {
+        "Search": agent.tool_cache_settings.ttl_search,
+        "Weather": agent.tool_cache_settings.ttl_weather,
+        "Wikipedia": agent.tool_cache_settings.ttl_wikipedia,
+    }
+    tools = []
+    for name in ("Search", "Wikipedia", "Weather", "Calculator"):
+        func = fake_tool(name, args.tool_latency_ms)
+        if name in ttls:
+            func = agent.cached_tool(name, func, ttls[name])
+        tools.append(Tool(name=name, func=telemetry.timed(f"tool.{name}", func), description=f"Useful for {name.lower()} questions."))
+    agent.agent_chain.tools = tools
+
+    # The null voice is silence as long as the answer would take to say, played through the real output thread
+    NullBackend.chars_per_second *= args.speed
+    speech = SpeechPipeline(TTSService(telemetry=telemetry), cache=SpeechCache.from_settings(SpeechCacheSettings()), telemetry=telemetry, output=AudioOutput(telemetry=telemetry))
+
+    vad_settings = VoiceActivitySettings()
+    microphone = ReplayMicrophone(speed=args.speed, buffer_seconds=vad_settings.max_utterance + 10)
+    microphone.loud_threshold = lambda: microphone.energy_threshold(vad_settings.energy_ratio, vad_settings.min_energy)
+    voice_activity = VoiceActivityDetector(microphone, vad_settings)
+    transcribe = build_transcriber(args, telemetry)
+
+    scenario = DEFAULT_SCENARIO
+    base_dir = ROOT
+    if args.scenario:
+        scenario = json.loads(args.scenario.read_text())
+        base_dir = args.scenario.parent
+
+    microphone.start()
+    startup = time.perf_counter() - STARTED
+    # Let the noise floor settle the way it would while waiting for the wake word
+    time.sleep(1.0 / args.speed)
+
+    for repeat in range(args.repeat):
+        for index, turn in enumerate(scenario):
+            audio = load_audio(turn, base_dir, seed=index)
+            start = microphone.cursor()
+            microphone.play(audio)
+
+            with telemetry.span("voice.capture"):
+                captured = voice_activity.listen(start)
+            spoke_until = microphone.last_loud_at or time.perf_counter()
+            with telemetry.span("voice.transcribe"):
+                text = transcribe(captured, turn)
+
+            agent.llm.responses = []
+            if turn.get("tool"):
+                agent.llm.responses.append(agent_json(turn["tool"], text))
+            agent.llm.responses.append(agent_json("Final Answer", turn["answer"]))
+            route, response = run_turn(text, speech)
+            done = time.perf_counter()
+
+            if speech.first_clip_at is not None:
+                telemetry.record("e2e.first_audio", speech.first_clip_at - spoke_until)
+            telemetry.record("e2e.turn", done - spoke_until)
+            print(f"[{repeat + 1}/{args.repeat}] turn {index + 1}: {text!r} -> {route.intent} in {(done - spoke_until) * 1000:.0f}ms")
+
+    microphone.stop()
+    return {
+        "startup_seconds": startup,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {name: telemetry.percentiles(name) for name in sorted(telemetry.samples)},
+        "settings": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+    }
+
+def print_results(results):
+    rss = results["peak_rss_mb"]
+    print(f"\nStartup {results['startup_seconds'] * 1000:.0f}ms, peak RSS {'unavailable' if rss is None else f'{rss:.1f}MB'}")
+    for name, stats in results["stages"].items():
+        print(f"{name:<24} n={stats['count']:<4} p50 {stats['p50'] * 1000:8.1f}ms  p95 {stats['p95'] * 1000:8.1f}ms  p99 {stats['p99'] * 1000:8.1f}ms")
+
+def compare(base, current, threshold):
+    # Flags anything that got slower (or bigger) by more than threshold percent
+    print(f"\n{'metric':<32} {'base':>10} {'current':>10} {'change':>8}")
+    rows = [("startup ms", base["startup_seconds"] * 1000, current["startup_seconds"] * 1000)]
+    if base.get("peak_rss_mb") is not None and current["peak_rss_mb"] is not None:
+        rows.append(("peak RSS MB", base["peak_rss_mb"], current["peak_rss_mb"]))
+    for name, stats in current["stages"].items():
+        if name in base["stages"]:
+            for key in ("p50", "p95"):
+                rows.append((f"{name} {key} ms", base["stages"][name][key] * 1000, stats[key] * 1000))
+    regressions = 0
+    for label, before, after in rows:
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{label:<32} {before:10.1f} {after:10.1f} {change:7.1f}%{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", help="JSON list of turns, the built-in scenario with synthetic audio is used by default")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay audio and play the null voice faster than real time")
+    parser.add_argument("--whisper", help="Transcribe with this Whisper model instead of returning the scripted text")
+    parser.add_argument("--transcribe-ms", type=float, default=150)
+    parser.add_argument("--llm-first-token-ms", type=float, default=400)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=60)
+    parser.add_argument("--tool-latency-ms", type=float, default=300)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--compare", help="Compare against a previous --output file")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent slowdown reported as a regression")
+    args = parser.parse_args()
+    # run() moves into a scratch directory, so paths given on the command line are resolved first
+    args.scenario = Path(args.scenario).resolve() if args.scenario else None
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+
+    results = run(args)
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), results, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
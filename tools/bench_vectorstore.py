@@ -0,0 +1,95 @@
+# Compares query latency of the local memory-mapped vector store against the remote (Pinecone) path
+# The remote side is a local stub that adds a configurable network round trip, so no API keys are needed
+# Run it from the repo root, for example: python tools/bench_vectorstore.py --rows 50000 --latency-ms 80
+
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from local_vectorstore import LocalVectorStore
+
+class HashEmbeddings:
+    # Deterministic stand-in for OpenAIEmbeddings with the same vector size
+    def __init__(self, dim=1536):
+        self.dim = dim
+
+    def embed_query(self, text):
+        seed = int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+class RemoteIndexStub:
+    # Behaves like a hosted index: one round trip per query, brute force search on the "server"
+    def __init__(self, vectors, texts, embedding, latency_ms):
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.texts = texts
+        self.embedding = embedding
+        self.latency = latency_ms / 1000
+
+    def similarity_search(self, query, k=4):
+        vector = np.asarray(self.embedding.embed_query(query), dtype=np.float32)
+        time.sleep(self.latency)
+        scores = self.vectors @ (vector / np.linalg.norm(vector))
+        return [self.texts[i] for i in np.argsort(-scores)[:k]]
+
+def report(name, timings):
+    timings = np.array(timings) * 1000
+    print(f"{name:<26} mean {timings.mean():8.2f}ms  p50 {np.percentile(timings, 50):8.2f}ms  p95 {np.percentile(timings, 95):8.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=80)
+    args = parser.parse_args()
+
+    embedding = HashEmbeddings(args.dim)
+    rng = np.random.default_rng(0)
+    texts = [f"document {i}" for i in range(args.rows)]
+    vectors = rng.standard_normal((args.rows, args.dim)).astype(np.float32)
+    queries = [f"question {i}" for i in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as path:
+        store = LocalVectorStore(path, embedding)
+        start = time.perf_counter()
+        for i in range(0, args.rows, 5000):
+            store.add_embeddings(texts[i:i + 5000], vectors[i:i + 5000])
+        print(f"Built local index of {args.rows} x {args.dim} in {time.perf_counter() - start:.2f}s")
+
+        remote = RemoteIndexStub(vectors, texts, embedding, args.latency_ms)
+        # Warm the page cache and the memory map before timing
+        store.similarity_search(queries[0], k=args.k)
+
+        local_timings = []
+        for query in queries:
+            start = time.perf_counter()
+            store.similarity_search(query, k=args.k)
+            local_timings.append(time.perf_counter() - start)
+
+        query_vectors = embedding.embed_documents(queries)
+        start = time.perf_counter()
+        store.search_vectors(query_vectors, k=args.k)
+        batched = (time.perf_counter() - start) / len(queries)
+
+        remote_timings = []
+        for query in queries:
+            start = time.perf_counter()
+            remote.similarity_search(query, k=args.k)
+            remote_timings.append(time.perf_counter() - start)
+
+        report("local", local_timings)
+        report("local batched (per query)", [batched])
+        report(f"remote stub ({args.latency_ms:.0f}ms rtt)", remote_timings)
+
+if __name__ == "__main__":
+    main()
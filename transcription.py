@@ -0,0 +1,84 @@
+# Keeps one Whisper model loaded for the lifetime of the app so each prompt only pays for decoding
+# Model size and decode options can be changed in the [voice] section of settings.ini. torch and whisper are only
+# imported when the model is loaded, and with background_model_loading on that happens on a thread after startup,
+# transcribe waits for it if it's called before the model is ready
+
+import time
+import threading
+import configparser
+
+import numpy as np
+
+from audio_io import WHISPER_SAMPLE_RATE
+
+class TranscriptionSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.model = config.get("voice", "whisper_model", fallback="base")
+        self.language = config.get("voice", "whisper_language", fallback="en")
+        self.beam_size = config.getint("voice", "whisper_beam_size", fallback=1)
+        self.temperature = config.getfloat("voice", "whisper_temperature", fallback=0.0)
+        self.background_load = config.getboolean("startup", "background_model_loading", fallback=True)
+
+class TranscriptionService:
+    def __init__(self, settings=None):
+        self.settings = settings or TranscriptionSettings()
+        self.model = None
+        self.device = None
+        self.error = None
+        self.ready = threading.Event()
+
+        # fp16 is only faster on GPU, it's switched on once the device is known
+        # A single fixed temperature skips the fallback re-decodes, and beam_size None means greedy decoding
+        self.decode_options = {
+            "language": self.settings.language or None,
+            "fp16": False,
+            "temperature": self.settings.temperature,
+            "beam_size": self.settings.beam_size if self.settings.beam_size > 1 else None,
+            "condition_on_previous_text": False,
+            "without_timestamps": True,
+        }
+
+        if self.settings.background_load:
+            threading.Thread(target=self.load, daemon=True).start()
+        else:
+            self.load()
+
+    def load(self):
+        try:
+            start = time.perf_counter()
+            import torch
+            import whisper
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            self.decode_options["fp16"] = self.device == "cuda"
+            self.model = whisper.load_model(self.settings.model, device=self.device)
+            print(f"Loaded Whisper '{self.settings.model}' model on {self.device} in {time.perf_counter() - start:.2f}s")
+            self.warm_up()
+        except Exception as e:
+            self.error = e
+            if self.settings.background_load:
+                print(f"Failed to load Whisper '{self.settings.model}': {e}")
+            else:
+                raise
+        finally:
+            self.ready.set()
+
+    def wait_ready(self):
+        self.ready.wait()
+        if self.error is not None:
+            raise RuntimeError(f"Whisper '{self.settings.model}' model failed to load") from self.error
+
+    def warm_up(self):
+        # Run one pass over a second of silence so the first real prompt doesn't pay for lazy initialization
+        start = time.perf_counter()
+        self.model.transcribe(np.zeros(WHISPER_SAMPLE_RATE, dtype=np.float32), **self.decode_options)
+        print(f"Whisper warm-up took {time.perf_counter() - start:.2f}s")
+
+    def transcribe(self, audio):
+        self.wait_ready()
+        start = time.perf_counter()
+        result = self.model.transcribe(audio, **self.decode_options)
+        print(f"Transcribed in {time.perf_counter() - start:.2f}s")
+        return result["text"].strip()
@@ -0,0 +1,318 @@
+# Text-to-speech service
+# Each backend is loaded once on its own worker thread and takes utterances from a queue, so the engine stays warm
+# and pyttsx3 stays on the thread that created it. An utterance is one or more sentences and its audio is streamed
+# back in chunks. Every utterance reports its synthesis time and real-time factor (synthesis time over audio length,
+# below 1 is faster than real time). The backend is looked up in settings.ini again when the file changes, so
+# switching between them doesn't need a restart
+
+import os
+import time
+import queue
+import tempfile
+import threading
+import configparser
+
+import numpy as np
+
+from speech_cache import read_wav
+from bark_worker import BarkEngine, BarkProcess, batch_sentences
+from telemetry import Telemetry
+
+class TTSSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        # pyttsx3, bark or null (silence, for benchmarks), use_bark is still honoured when tts_backend isn't set
+        use_bark = config.getboolean("voice", "use_bark", fallback=False)
+        self.backend = config.get("voice", "tts_backend", fallback="bark" if use_bark else "pyttsx3").strip().lower()
+        self.history_prompt = config.get("voice", "history_prompt", fallback="en_british")
+        self.rate = config.getint("voice", "rate", fallback=150)
+        # Bark runs in its own process by default, small models and CPU offload trade some quality for speed and memory
+        self.bark_process = config.getboolean("voice", "bark_process", fallback=True)
+        self.bark_small_models = config.getboolean("voice", "bark_small_models", fallback=False)
+        self.bark_offload_cpu = config.getboolean("voice", "bark_offload_cpu", fallback=False)
+        self.bark_use_gpu = config.getboolean("voice", "bark_use_gpu", fallback=True)
+        # Sentences waiting to be rendered are packed into Bark passes of up to this many characters
+        self.bark_batch_chars = config.getint("voice", "bark_batch_chars", fallback=220)
+
+class TTSBackend:
+    name = None
+    # Above 0 the speech pipeline hands over every sentence that's waiting at once, up to a few passes worth
+    batch_chars = 0
+
+    def load(self):
+        # Runs once on the worker thread before the first utterance
+        pass
+
+    def cache_name(self):
+        return self.name
+
+    def cache_params(self):
+        # Everything besides the text that changes how a clip sounds
+        return {}
+
+    def options(self):
+        # Everything that needs a separately loaded backend, a worker is kept per set of options
+        return self.cache_params()
+
+    def update(self, settings):
+        # Settings that a loaded backend can take without loading again
+        pass
+
+    def synthesize(self, text):
+        # Returns (float32 samples, sample rate)
+        raise NotImplementedError
+
+    def stream(self, sentences):
+        # Yields (float32 samples, sample rate) chunks covering the sentences in order
+        yield self.synthesize(" ".join(sentences))
+
+    def cancel(self):
+        pass
+
+class Pyttsx3Backend(TTSBackend):
+    name = "pyttsx3"
+
+    def __init__(self, settings):
+        self.rate = settings.rate
+        self.engine = None
+
+    def load(self):
+        import pyttsx3
+        self.engine = pyttsx3.init()
+
+    def cache_params(self):
+        return {"rate": self.rate}
+
+    def options(self):
+        # pyttsx3.init() hands every thread the same engine, so there's only ever one pyttsx3 worker
+        return {}
+
+    def update(self, settings):
+        self.rate = settings.rate
+
+    def synthesize(self, text):
+        # Rendered to a file instead of spoken, so the clip goes through the same cache and output queue as Bark.
+        # The rate is set on every call, on the worker thread, so it always matches the rate the clip is cached under
+        handle, path = tempfile.mkstemp(suffix=".wav")
+        os.close(handle)
+        try:
+            self.engine.setProperty('rate', self.rate)
+            self.engine.save_to_file(text, path)
+            self.engine.runAndWait()
+            return read_wav(path)
+        finally:
+            os.remove(path)
+
+class BarkBackend(TTSBackend):
+    name = "bark"
+
+    def __init__(self, settings):
+        self.history_prompt = settings.history_prompt
+        self.use_process = settings.bark_process
+        self.small_models = settings.bark_small_models
+        self.offload_cpu = settings.bark_offload_cpu
+        self.use_gpu = settings.bark_use_gpu
+        self.batch_chars = settings.bark_batch_chars
+        self.engine = None
+        self.process = None
+
+    def load(self):
+        if self.use_process:
+            self.process = BarkProcess(self.small_models, self.offload_cpu, self.use_gpu).start()
+            self.process.wait_ready()
+        else:
+            self.engine = BarkEngine(self.small_models, self.offload_cpu, self.use_gpu)
+            self.engine.load()
+
+    def cache_name(self):
+        # The small models sound different, so their clips are cached apart
+        return "bark-small" if self.small_models else "bark"
+
+    def cache_params(self):
+        return {"history_prompt": self.history_prompt}
+
+    def options(self):
+        # The voice is sent with each request, so changing it doesn't load the models again
+        return {"process": self.use_process, "small_models": self.small_models, "offload_cpu": self.offload_cpu, "use_gpu": self.use_gpu}
+
+    def update(self, settings):
+        self.history_prompt = settings.history_prompt
+        self.batch_chars = settings.bark_batch_chars
+
+    def synthesize(self, text):
+        chunks = [chunk for chunk, _ in self.stream([text])]
+        # A request cancelled before its first batch comes back without any chunks
+        if not chunks:
+            return np.zeros(0, dtype=np.float32), self.sample_rate()
+        return np.concatenate(chunks), self.sample_rate()
+
+    def sample_rate(self):
+        return self.process.sample_rate if self.process is not None else self.engine.sample_rate
+
+    def stream(self, sentences):
+        batches = batch_sentences(sentences, self.batch_chars)
+        if self.process is not None:
+            for audio, sample_rate, _ in self.process.generate(batches, self.history_prompt):
+                yield audio, sample_rate
+            return
+        for batch in batches:
+            yield self.engine.generate(batch, self.history_prompt), self.engine.sample_rate
+
+    def cancel(self):
+        if self.process is not None:
+            self.process.cancel()
+
+class NullBackend(TTSBackend):
+    # Silence about as long as the sentence would take to say, for benchmarks and machines without audio
+    name = "null"
+    sample_rate = 16000
+    chars_per_second = 15
+
+    def __init__(self, settings):
+        pass
+
+    def synthesize(self, text):
+        return np.zeros(int(len(text) / self.chars_per_second * self.sample_rate), dtype=np.float32), self.sample_rate
+
+BACKENDS = {backend.name: backend for backend in (Pyttsx3Backend, BarkBackend, NullBackend)}
+
+class Utterance:
+    def __init__(self, sentences):
+        self.sentences = [sentences] if isinstance(sentences, str) else list(sentences)
+        self.chunks = queue.Queue()
+        self.error = None
+        self.cancelled = False
+
+    def stream(self):
+        # Yields (samples, sample rate) chunks as the worker produces them
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    def result(self):
+        chunks = list(self.stream())
+        if not chunks:
+            return np.zeros(0, dtype=np.float32), 16000
+        return np.concatenate([audio for audio, _ in chunks]), chunks[0][1]
+
+class TTSWorker:
+    def __init__(self, backend, telemetry):
+        self.backend = backend
+        self.telemetry = telemetry
+        self.utterances = queue.Queue()
+        self.current = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, sentences):
+        utterance = Utterance(sentences)
+        self.utterances.put(utterance)
+        return utterance
+
+    def cancel(self):
+        # Drops queued utterances and cuts the current one short
+        while True:
+            try:
+                utterance = self.utterances.get_nowait()
+            except queue.Empty:
+                break
+            utterance.cancelled = True
+            utterance.chunks.put(None)
+        current = self.current
+        if current is not None:
+            current.cancelled = True
+            self.backend.cancel()
+
+    def _run(self):
+        load_error = None
+        try:
+            with self.telemetry.span(f"tts.{self.backend.name}.load"):
+                self.backend.load()
+        except Exception as e:
+            load_error = e
+        while True:
+            utterance = self.utterances.get()
+            if load_error is not None:
+                utterance.error = load_error
+                utterance.chunks.put(None)
+                continue
+            self.current = utterance
+            try:
+                chars = sum(len(sentence) for sentence in utterance.sentences)
+                with self.telemetry.span(f"tts.{self.backend.name}", chars=chars, sentences=len(utterance.sentences)) as span:
+                    start = time.perf_counter()
+                    audio_seconds = 0.0
+                    for audio, sample_rate in self.backend.stream(utterance.sentences):
+                        if "first_chunk_ms" not in span:
+                            span["first_chunk_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                        audio_seconds += len(audio) / sample_rate
+                        utterance.chunks.put((audio, sample_rate))
+                        if utterance.cancelled:
+                            break
+                    seconds = time.perf_counter() - start
+                    span["audio_seconds"] = round(audio_seconds, 2)
+                    span["rtf"] = round(seconds / audio_seconds, 3) if audio_seconds else None
+            except Exception as e:
+                utterance.error = e
+            self.current = None
+            utterance.chunks.put(None)
+
+class TTSService:
+    def __init__(self, settings_path="settings.ini", telemetry=None, check_interval=1.0):
+        self.settings_path = settings_path
+        self.telemetry = telemetry or Telemetry()
+        self.check_interval = check_interval
+        self.workers = {}
+        self.lock = threading.Lock()
+        self.settings_mtime = None
+        self.checked_at = 0.0
+        self.worker = None
+        self.reload()
+
+    def reload(self):
+        # Picks the backend from settings.ini, workers are kept per configuration so switching back is instant
+        settings = TTSSettings(self.settings_path)
+        if settings.backend not in BACKENDS:
+            print(f"Unknown tts_backend '{settings.backend}', using pyttsx3")
+            settings.backend = "pyttsx3"
+        backend = BACKENDS[settings.backend](settings)
+        key = (backend.name, tuple(sorted(backend.options().items())))
+        with self.lock:
+            if key not in self.workers:
+                self.workers[key] = TTSWorker(backend, self.telemetry)
+            else:
+                self.workers[key].backend.update(settings)
+            if self.worker is not None and self.worker is not self.workers[key]:
+                print(f"Switched speech synthesis to {backend.name}")
+            self.worker = self.workers[key]
+
+    def current(self):
+        # Looks at the settings file at most once per check_interval, a changed file is read again
+        now = time.monotonic()
+        if now - self.checked_at >= self.check_interval:
+            self.checked_at = now
+            try:
+                mtime = os.stat(self.settings_path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self.settings_mtime:
+                if self.settings_mtime is not None:
+                    self.reload()
+                self.settings_mtime = mtime
+        return self.worker
+
+    def backend(self):
+        return self.current().backend
+
+    def cancel(self):
+        self.current().cancel()
+
+    def cache_key(self, cache, text, backend=None):
+        backend = backend or self.backend()
+        return cache.key(text, backend.cache_name(), **backend.cache_params())
@@ -0,0 +1,49 @@
+# One voice turn, from the transcribed prompt to the end of the spoken answer
+# main.py and tools/bench_turns.py both run turns through here, so the benchmark measures the same routing, agent run,
+# caches and speech pipeline the user gets
+
+import threading
+
+from agent import run_agent, route_turn, telemetry
+from callbacks import RunCancelled
+
+def run_agent_with_speech(input_text, speech, route=None):
+    # The agent runs on a worker thread and streams its final answer into the speech pipeline,
+    # so the first sentence is playing while the rest of the answer is still being generated
+    # If the user talks over the answer the agent run is cancelled too and None is returned
+    result = {}
+    cancel_event = threading.Event()
+
+    def on_barge_in(index):
+        cancel_event.set()
+
+    def run():
+        try:
+            result["response"] = run_agent(input_text, on_token=speech.feed, source="voice", cancel_event=cancel_event, route=route)
+        except RunCancelled:
+            result["response"] = None
+        except Exception as e:
+            result["error"] = e
+        finally:
+            speech.close(result.get("response"))
+
+    speech.output.barge_in_listeners.append(on_barge_in)
+    try:
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        speech.play()
+        worker.join()
+    finally:
+        speech.output.barge_in_listeners.remove(on_barge_in)
+
+    if "error" in result:
+        raise result["error"]
+    return result["response"]
+
+def run_turn(input_text, speech):
+    # Returns (route, response), response is None if the user talked over the answer
+    with telemetry.span("voice.turn") as span:
+        route = route_turn(input_text)
+        span["intent"] = route.intent
+        response = run_agent_with_speech(input_text, speech, route)
+    return route, response
@@ -0,0 +1,117 @@
+# Offline wake word detection
+# An energy gate over the microphone ring buffer picks out bursts of speech, and only those bursts are
+# transcribed by a tiny Whisper model and fuzzy matched against the wake word, so silence costs almost nothing
+
+import re
+import difflib
+import configparser
+
+from microphone import chunk_rms
+from transcription import TranscriptionService, TranscriptionSettings
+
+class WakeWordSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.model = config.get("wake_word", "model", fallback="tiny")
+        self.sensitivity = config.getfloat("wake_word", "sensitivity", fallback=0.5)
+        self.energy_ratio = config.getfloat("wake_word", "energy_ratio", fallback=2.5)
+        self.min_energy = config.getfloat("wake_word", "min_energy", fallback=300)
+        self.max_window = config.getfloat("wake_word", "max_window", fallback=2.0)
+
+class WakeWord:
+    # A detection: the chunk indexes the speech segment started and ended at, what the tiny model heard, and the words
+    # said after the wake word in that segment, empty if the user stopped after it
+    def __init__(self, start, end, transcription, prompt):
+        self.start = start
+        self.end = end
+        self.transcription = transcription
+        self.prompt = prompt
+
+class WakeWordDetector:
+    def __init__(self, microphone, wake_word, settings=None):
+        self.settings = settings or WakeWordSettings()
+        self.microphone = microphone
+        self.wake_word = wake_word.lower()
+
+        transcription_settings = TranscriptionSettings()
+        transcription_settings.model = self.settings.model
+        transcription_settings.beam_size = 1
+        transcription_settings.temperature = 0.0
+        self.transcriber = TranscriptionService(transcription_settings)
+        # Priming the decoder with the wake word makes Whisper far more likely to spell it the same way
+        self.transcriber.decode_options["initial_prompt"] = wake_word
+
+        # Sensitivity 0 needs an exact spelling, 1 accepts anything half similar
+        self.match_threshold = 1.0 - 0.5 * min(max(self.settings.sensitivity, 0.0), 1.0)
+
+    def find(self, transcription):
+        # Character offset right after the best match of the wake word, or None if nothing is close enough
+        words = list(re.finditer(r"[a-z']+", transcription.lower()))
+        size = len(self.wake_word.split())
+        best = 0.0
+        end = None
+        for i in range(len(words) - size + 1):
+            candidate = " ".join(word.group() for word in words[i:i + size])
+            ratio = difflib.SequenceMatcher(None, self.wake_word, candidate).ratio()
+            if ratio > best:
+                best, end = ratio, words[i + size - 1].end()
+        return end if best >= self.match_threshold else None
+
+    def matches(self, transcription):
+        return self.find(transcription) is not None
+
+    def strip(self, transcription):
+        # What was said after the wake word, the whole transcription if the wake word isn't in it
+        end = self.find(transcription)
+        if end is None:
+            return transcription.strip()
+        return transcription[end:].lstrip(" ,.!?;:-").strip()
+
+    def energy_gate(self):
+        # The noise floor is tracked by the microphone stream itself
+        return self.microphone.energy_threshold(self.settings.energy_ratio, self.settings.min_energy)
+
+    def wait(self):
+        # Blocks until the wake word is heard and returns a WakeWord, so the prompt can be picked up from the segment
+        # when the user carried straight on, or from where it ended otherwise. Returns None if the microphone stopped
+        chunk_seconds = self.microphone.chunk_seconds
+        preroll = max(1, int(0.3 / chunk_seconds))
+        hangover = max(1, int(0.4 / chunk_seconds))
+        overlap = max(1, int(0.5 / chunk_seconds))
+        max_chunks = max(1, int(self.settings.max_window / chunk_seconds))
+
+        cursor = self.microphone.cursor()
+        segment_start = None
+        quiet = 0
+        while True:
+            chunk, index = self.microphone.read(cursor)
+            if chunk is None:
+                return None
+            cursor = index + 1
+            energy = chunk_rms(chunk)
+            loud = energy > self.energy_gate()
+
+            if segment_start is None:
+                if not loud:
+                    continue
+                segment_start = index - preroll
+                quiet = 0
+                continue
+
+            quiet = 0 if loud else quiet + 1
+            window_full = cursor - segment_start >= max_chunks
+            if quiet < hangover and not window_full:
+                continue
+
+            audio_start = segment_start
+            audio = self.microphone.get_audio(segment_start, cursor)
+            # Keep listening across long phrases with some overlap so a wake word on the boundary isn't cut in half
+            segment_start = cursor - overlap if window_full and quiet < hangover else None
+
+            transcription = self.transcriber.transcribe(audio)
+            if transcription:
+                print(f"Heard: {transcription}")
+            if self.matches(transcription):
+                return WakeWord(audio_start, cursor, transcription, self.strip(transcription))
@@ -0,0 +1,105 @@
+# Wikipedia tool
+# Candidate pages are fetched concurrently, then a local extractive pass keeps the sentences that best match the query
+# until the token budget is used up. The LLM summarizer only runs on that trimmed text, and only if it is turned on
+
+import re
+import math
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+
+import wikipedia
+from langchain.docstore.document import Document
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from", "how", "in", "is", "it",
+    "of", "on", "or", "that", "the", "to", "was", "were", "what", "when", "where", "which", "who", "why", "with",
+}
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+WORD = re.compile(r"[a-z0-9]+")
+
+class WikipediaSettings:
+    def __init__(self, file_path="settings.ini"):
+        config = configparser.ConfigParser()
+        config.read(file_path)
+
+        self.top_k_results = config.getint("wikipedia", "top_k_results", fallback=3)
+        self.max_tokens = config.getint("wikipedia", "max_tokens", fallback=600)
+        self.use_llm_summary = config.getboolean("wikipedia", "use_llm_summary", fallback=False)
+
+def approximate_tokens(text):
+    # Close enough to the tokenizer for English prose, and free
+    return int(len(text.split()) * 1.3) + 1
+
+class WikipediaTool:
+    def __init__(self, summarize_chain=None, top_k_results=3, max_tokens=600, use_llm_summary=False):
+        self.summarize_chain = summarize_chain
+        self.top_k_results = top_k_results
+        self.max_tokens = max_tokens
+        self.use_llm_summary = use_llm_summary and summarize_chain is not None
+
+    @classmethod
+    def from_settings(cls, summarize_chain, settings):
+        return cls(summarize_chain, settings.top_k_results, settings.max_tokens, settings.use_llm_summary)
+
+    def fetch(self, title):
+        try:
+            page = wikipedia.page(title=title, auto_suggest=False)
+            return page.title, page.content
+        except (wikipedia.exceptions.PageError, wikipedia.exceptions.DisambiguationError):
+            return None
+
+    def extract(self, query, pages):
+        terms = {word for word in WORD.findall(query.lower()) if word not in STOPWORDS}
+        sentences = []
+        for page_index, (title, content) in enumerate(pages):
+            # Skip section headings and other lines that aren't prose
+            text = " ".join(line for line in content.splitlines() if not line.startswith("=="))
+            for position, sentence in enumerate(SENTENCE_END.split(text)):
+                sentence = sentence.strip()
+                if sentence:
+                    sentences.append((page_index, position, sentence, set(WORD.findall(sentence.lower()))))
+
+        # Rare query words count for more, short sentences aren't favoured just for being short,
+        # and each page's opening sentences get a bonus since they usually define the subject
+        document_frequency = {term: sum(1 for *_, words in sentences if term in words) for term in terms}
+        scored = []
+        for page_index, position, sentence, words in sentences:
+            score = sum(math.log(1 + len(sentences) / document_frequency[term]) for term in terms if term in words)
+            score /= math.sqrt(max(len(words), 5))
+            if position < 3:
+                score += 1.0 - position * 0.25
+            score -= page_index * 0.05
+            scored.append((score, page_index, position, sentence))
+
+        selected = []
+        budget = self.max_tokens
+        for score, page_index, position, sentence in sorted(scored, key=lambda item: -item[0]):
+            tokens = approximate_tokens(sentence)
+            if tokens > budget:
+                continue
+            selected.append((page_index, position, sentence))
+            budget -= tokens
+            if budget < 10:
+                break
+
+        extracts = []
+        for page_index, (title, _) in enumerate(pages):
+            page_sentences = [sentence for index, _, sentence in sorted(selected) if index == page_index]
+            if page_sentences:
+                extracts.append((title, " ".join(page_sentences)))
+        return extracts
+
+    def run(self, query):
+        titles = wikipedia.search(query)[:self.top_k_results]
+        if not titles:
+            return "No good Wikipedia Search Result was found"
+
+        with ThreadPoolExecutor(max_workers=len(titles)) as pool:
+            pages = [page for page in pool.map(self.fetch, titles) if page is not None]
+        if not pages:
+            return "No good Wikipedia Search Result was found"
+
+        extracts = self.extract(query, pages)
+        if self.use_llm_summary:
+            return self.summarize_chain.run([Document(page_content=text, metadata={"title": title}) for title, text in extracts])
+        return "\n\n".join(f"Page: {title}\nSummary: {text}" for title, text in extracts)